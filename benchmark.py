@@ -0,0 +1,348 @@
+"""
+Benchmarks of the stages of kovid.py on synthetic daily reports in the CSSE
+format: parsing, loading, storing, the series accessors, the derived metrics
+and every plot. Each stage is timed (best of --repeat runs) and its peak
+memory is traced in a separate run. The results can be stored as baseline and
+later runs are compared with it:
+
+    python benchmark.py --save-baseline
+    python benchmark.py
+"""
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+import kovid
+
+PATH_BASELINE = "benchmark_baseline.json"
+
+
+def get_layout(date, layout=None):
+    """
+    Returns the header of the report layout valid at date, or of the given
+    layout name, see kovid.REPORT_LAYOUTS.
+    """
+    if layout is not None:
+        return kovid.REPORT_LAYOUTS[layout]
+    valid = [
+        name
+        for name in kovid.REPORT_LAYOUTS
+        if pd.Timestamp(name) <= pd.Timestamp(date)
+    ]
+    return kovid.REPORT_LAYOUTS[max(valid, key=pd.Timestamp)]
+
+
+def generate_reports(
+    path_name,
+    days=120,
+    countries=50,
+    provinces=4,
+    admin2=25,
+    start="2020-01-22",
+    layout=None,
+    seed=0,
+):
+    """
+    Writes synthetic daily reports in the CSSE format. The countries of
+    kovid.COUNTRY_LIST come first, so that all plots have data. Every fifth
+    country reports per province and the US additionally per Admin2 region
+    once the layout has an Admin2 column, like in the real data.
+
+    Input:
+        path_name   str     directory the reports are written to
+        days        int     number of daily reports
+        countries   int     number of countries
+        provinces   int     number of provinces of the countries with
+                            provinces
+        admin2      int     number of Admin2 regions per US province
+        start       str     date of the first report
+        layout      str     name of the layout of all reports, by default the
+                            layout valid at the date of each report
+        seed        int     seed of the random numbers
+    """
+    os.makedirs(path_name, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    names = list(kovid.COUNTRY_LIST)[:countries]
+    names += ["Country {}".format(i) for i in range(countries - len(names))]
+
+    # (country, province, admin2) of every row of a report with Admin2 column
+    regions = []
+    for i, country in enumerate(names):
+        if country == "US":
+            for p in range(provinces):
+                for a in range(admin2):
+                    regions.append(
+                        (country, "State {}".format(p), "County {}".format(a))
+                    )
+        elif i % 5 == 4:
+            for p in range(provinces):
+                regions.append((country, "Province {}".format(p), ""))
+        else:
+            regions.append((country, "", ""))
+
+    # Cumulative counts with a noisy exponential growth that slows down
+    t = np.arange(days)[:, None]
+    growth = rng.uniform(0.1, 0.3, len(regions)) * np.exp(-t / 60)
+    new_cases = rng.poisson(np.exp(np.cumsum(growth, axis=0)))
+    confirmed = np.cumsum(new_cases, axis=0)
+    deaths = np.cumsum(rng.binomial(new_cases, 0.02), axis=0)
+    recovered = np.cumsum(rng.binomial(new_cases, 0.5), axis=0)
+
+    for d, date in enumerate(pd.date_range(start, periods=days)):
+        header = get_layout(date, layout)
+        rows = {}
+        for r, (country, province, county) in enumerate(regions):
+            if "Admin2" not in header:
+                # Without Admin2 column the counties get summed up per province
+                key = (country, province, "")
+            else:
+                key = (country, province, county)
+            counts = rows.setdefault(key, np.zeros(3, dtype=int))
+            counts += confirmed[d, r], deaths[d, r], recovered[d, r]
+
+        fname = join(path_name, date.strftime("%m-%d-%Y") + ".csv")
+        with open(fname, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for (country, province, county), counts in rows.items():
+                values = {
+                    "Province/State": province,
+                    "Province_State": province,
+                    "Country/Region": country,
+                    "Country_Region": country,
+                    "Admin2": county,
+                    "Last Update": date.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "Last_Update": date.strftime("%Y-%m-%d %H:%M:%S"),
+                    "Confirmed": counts[0],
+                    "Deaths": counts[1],
+                    "Recovered": counts[2],
+                    "Active": counts[0] - counts[1] - counts[2],
+                    "Combined_Key": ", ".join(
+                        n for n in (county, province, country) if n
+                    ),
+                }
+                writer.writerow([values.get(col, "") for col in header])
+
+
+def measure(function, repeat=3):
+    """
+    Returns the best time of repeat runs of function in seconds and the peak
+    memory allocated by an additional traced run in bytes.
+    """
+    seconds = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - t0)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def run_benchmarks(path_name, repeat=3, processes=1):
+    """
+    Times the stages of kovid.py on the reports in path_name.
+
+    Returns:
+        results     dict    stage -> {"seconds", "peak_mb"}
+    """
+    results = {}
+    # kovid.py expects the directory with a trailing separator
+    path_name = join(path_name, "")
+
+    def stage(name, function, repeat=repeat):
+        seconds, peak = measure(function, repeat)
+        results[name] = {"seconds": seconds, "peak_mb": peak / 2 ** 20}
+        print("{:<40} {:>9.4f} s {:>9.1f} MB".format(name, seconds, peak / 2 ** 20))
+
+    # The first and the last report, i.e. the oldest and the newest layout
+    reports = kovid.get_report_list(path_name)
+    dates = kovid.get_date_list(reports)
+    for i in [np.argmin(dates), np.argmax(dates)]:
+        stage(
+            "get_dataframe_from_csv_file {}".format(reports[i]),
+            lambda: kovid.get_dataframe_from_csv_file(
+                join(path_name, reports[i]), dates[i]
+            ),
+        )
+    stage(
+        "get_data",
+        lambda: kovid.get_data(path_name, processes=processes),
+    )
+    stage(
+        "get_data regions",
+        lambda: kovid.get_data(path_name, no_provinces=False, processes=processes),
+    )
+
+    data = kovid.normalize_data(kovid.get_data(path_name, no_provinces=False))
+    with tempfile.TemporaryDirectory() as tmp:
+        for fname in ["data.feather", "data.csv"]:
+            path = join(tmp, fname)
+            stage("save_data " + fname, lambda: kovid.save_data(data, path))
+            stage("load_data " + fname, lambda: kovid.load_data(path))
+
+    stage("TimeSeriesStore", lambda: kovid.TimeSeriesStore(data))
+    store = kovid.TimeSeriesStore(data)
+    stage("compute_metrics", lambda: kovid.compute_metrics(store))
+    metrics = store.get_metrics()
+    stage(
+        "compute_log_trends",
+        lambda: kovid.compute_log_trends(metrics["Confirmed"], 7, 21),
+    )
+    stage("compute_growth", lambda: kovid.compute_growth(metrics["Confirmed"], 7))
+
+    countries = store.get_regions(level=0)
+    for accessor in [
+        kovid.get_confirmed_by_country,
+        kovid.get_deaths_by_country,
+        kovid.get_new_infections_by_country,
+        kovid.get_spread_rate_by_country,
+        kovid.get_infection_rate_by_country,
+        kovid.get_growth_rate_by_country,
+    ]:
+        stage(
+            accessor.__name__,
+            lambda: [accessor(c, store) for c in countries],
+        )
+
+    country_list = kovid.get_country_list()
+    stage("sweep_estimates", lambda: kovid.sweep_estimates(store, country_list))
+
+    # Every plot gets rendered into an empty directory, so that none is
+    # skipped as up to date
+    kovid.plt.switch_backend("Agg")
+    cwd = os.getcwd()
+    for name, plot_function in kovid.PLOT_FUNCTIONS.items():
+        if plot_function is kovid.plot_fraction_tested_from_deaths:
+            plots = {"Germany": country_list["Germany"]}
+        else:
+            plots = country_list
+
+        def render():
+            with tempfile.TemporaryDirectory() as tmp:
+                os.chdir(tmp)
+                try:
+                    os.mkdir("png")
+                    plot_function(store, plots)
+                finally:
+                    os.chdir(cwd)
+
+        stage("plot " + name, render)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=0.005):
+    """
+    Prints the results next to the baseline. Returns the stages that got
+    slower than the baseline by more than the tolerance. Stages that got
+    slower by less than min_seconds are ignored, their timings are mostly
+    noise.
+    """
+    slower = []
+    print(
+        "{:<40} {:>10} {:>10} {:>7} {:>9} {:>9}".format(
+            "stage", "seconds", "baseline", "ratio", "MB", "baseline"
+        )
+    )
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("{:<40} {:>10.4f}".format(name, result["seconds"]))
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        flag = ""
+        if (
+            ratio > 1 + tolerance
+            and result["seconds"] - base["seconds"] > min_seconds
+        ):
+            slower.append(name)
+            flag = "  slower"
+        print(
+            "{:<40} {:>10.4f} {:>10.4f} {:>7.2f} {:>9.1f} {:>9.1f}{}".format(
+                name,
+                result["seconds"],
+                base["seconds"],
+                ratio,
+                result["peak_mb"],
+                base["peak_mb"],
+                flag,
+            )
+        )
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--countries", type=int, default=50)
+    parser.add_argument("--provinces", type=int, default=4)
+    parser.add_argument("--admin2", type=int, default=25)
+    parser.add_argument(
+        "--layout",
+        choices=list(kovid.REPORT_LAYOUTS),
+        help="Write all reports in this layout instead of the one of their date",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Processes for parsing reports"
+    )
+    parser.add_argument("--baseline", default=PATH_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as baseline instead of comparing with it",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown that counts as regression",
+    )
+    args = parser.parse_args()
+
+    config = {
+        "days": args.days,
+        "countries": args.countries,
+        "provinces": args.provinces,
+        "admin2": args.admin2,
+        "layout": args.layout,
+        "jobs": args.jobs,
+    }
+    with tempfile.TemporaryDirectory() as path_name:
+        generate_reports(
+            path_name,
+            days=args.days,
+            countries=args.countries,
+            provinces=args.provinces,
+            admin2=args.admin2,
+            layout=args.layout,
+        )
+        results = run_benchmarks(path_name, repeat=args.repeat, processes=args.jobs)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=1)
+        print("Saved baseline to {}".format(args.baseline))
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("The baseline was run with {}".format(baseline["config"]))
+        slower = compare(results, baseline["results"], args.tolerance)
+        if slower:
+            raise SystemExit(
+                "{} stages are slower than the baseline".format(len(slower))
+            )
+    else:
+        print("No baseline found, run with --save-baseline to store one")
@@ -1,22 +1,163 @@
 import pandas as pd
 import numpy as np
-import scipy as sp
-import scipy.interpolate
-import matplotlib.pyplot as plt
-from matplotlib.ticker import ScalarFormatter
-import seaborn as sbn
-from os import listdir
+import csv
+import hashlib
+import importlib
+import inspect
+import json
+import math
+import warnings
+import multiprocessing
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice, repeat
+from os import listdir, makedirs, stat
 from os.path import isfile, join
+from urllib.parse import parse_qs, urlparse
+
+
+class _LazyModule:
+    """
+    Stand-in for a module that only gets imported on first attribute access,
+    so that callers which neither plot nor estimate do not pay for importing
+    matplotlib, seaborn and scipy.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+interpolate = _LazyModule("scipy.interpolate")
+stats = _LazyModule("scipy.stats")
+plt = _LazyModule("matplotlib.pyplot")
+ticker = _LazyModule("matplotlib.ticker")
+sbn = _LazyModule("seaborn")
+feather = _LazyModule("pyarrow.feather")
+Image = _LazyModule("PIL.Image")
 
 PATH_DAILY_REPORTS = "COVID-19/csse_covid_19_data/csse_covid_19_daily_reports/"
+PATH_TIME_SERIES = "COVID-19/csse_covid_19_data/csse_covid_19_time_series/"
+TIME_SERIES_FILES = {
+    "Confirmed": "time_series_covid19_confirmed_global.csv",
+    "Deaths": "time_series_covid19_deaths_global.csv",
+    "Recovered": "time_series_covid19_recovered_global.csv",
+}
+PATH_DATA = "data.feather"
+PATH_DATA_CSV = "data.csv"
+PATH_MANIFEST = "data_manifest.json"
+# Key of the manifest under which the options of the ingest are recorded
+MANIFEST_OPTIONS = "options"
+PATH_LOOKUP_TABLE = "COVID-19/csse_covid_19_data/UID_ISO_FIPS_LookUp_Table.csv"
+
+# Separator of the hierarchical region IDs "Country/Province/Admin2"
+REGION_SEP = "/"
+REGION_COLUMNS = ["Country/Region", "Province/State", "Admin2"]
+
+# Names under which countries appear in the CSSE data -> name used here
+COUNTRY_ALIASES = {
+    "United Kingdom": "UK",
+    "Mainland China": "China",
+    "Korea, South": "South Korea",
+    "Republic of Korea": "South Korea",
+    "Iran (Islamic Republic of)": "Iran",
+    "Hong Kong SAR": "Hong Kong",
+    "Macao SAR": "Macau",
+    "Taipei and environs": "Taiwan",
+    "Taiwan*": "Taiwan",
+    "Viet Nam": "Vietnam",
+    "Russian Federation": "Russia",
+    "Republic of Moldova": "Moldova",
+    "Czech Republic": "Czechia",
+    "Republic of Ireland": "Ireland",
+    "The Bahamas": "Bahamas",
+    "Bahamas, The": "Bahamas",
+    "The Gambia": "Gambia",
+    "Gambia, The": "Gambia",
+    "Cape Verde": "Cabo Verde",
+    "East Timor": "Timor-Leste",
+    "Vatican City": "Holy See",
+}
+
+# Header of every known daily report layout, by the first report using it
+_LAYOUT_MARCH_22 = (
+    "FIPS",
+    "Admin2",
+    "Province_State",
+    "Country_Region",
+    "Last_Update",
+    "Lat",
+    "Long_",
+    "Confirmed",
+    "Deaths",
+    "Recovered",
+    "Active",
+    "Combined_Key",
+)
+REPORT_LAYOUTS = {
+    "01-22-2020": (
+        "Province/State",
+        "Country/Region",
+        "Last Update",
+        "Confirmed",
+        "Deaths",
+        "Recovered",
+    ),
+    "03-01-2020": (
+        "Province/State",
+        "Country/Region",
+        "Last Update",
+        "Confirmed",
+        "Deaths",
+        "Recovered",
+        "Latitude",
+        "Longitude",
+    ),
+    "03-22-2020": _LAYOUT_MARCH_22,
+    "05-29-2020": _LAYOUT_MARCH_22 + ("Incidence_Rate", "Case-Fatality_Ratio"),
+    "11-09-2020": _LAYOUT_MARCH_22 + ("Incident_Rate", "Case_Fatality_Ratio"),
+}
+# Columns that get read from the reports -> column name used here
+REPORT_COLUMNS = {
+    "Province/State": "Province/State",
+    "Province_State": "Province/State",
+    "Country/Region": "Country/Region",
+    "Country_Region": "Country/Region",
+    "Admin2": "Admin2",
+    "Confirmed": "Confirmed",
+    "Deaths": "Deaths",
+    "Recovered": "Recovered",
+}
+# Names are converted to categoricals and counts to integers only once for the
+# whole data set (see normalize_data), parsing them per report is slower
+REPORT_DTYPES = {
+    "Province/State": str,
+    "Country/Region": str,
+    "Admin2": str,
+    "Confirmed": "float64",
+    "Deaths": "float64",
+    "Recovered": "float64",
+}
 
 
 def log_interp1d(xx, yy, kind="linear"):
     logx = np.log10(xx)
     logy = np.log10(yy)
-    # lin_interp = sp.interpolate.interp1d(logx, logy, kind=kind, bounds_error=False, fill_value="extrapolate")
+    # lin_interp = interpolate.interp1d(logx, logy, kind=kind, bounds_error=False, fill_value="extrapolate")
     # log_interp = lambda zz: np.power(10.0, lin_interp(np.log10(zz)))
-    lin_interp = sp.interpolate.interp1d(
+    lin_interp = interpolate.interp1d(
         xx, logy, kind=kind, bounds_error=False, fill_value="extrapolate"
     )
     log_interp = lambda zz: np.power(10.0, lin_interp(zz))
@@ -31,15 +172,39 @@ def log_extrapol(xx, yy):
     return log_interp
 
 
-def moving_average(data, window_size):
-    n = len(data)
-    avg = np.zeros(n)
-    div = np.arange(n)
-    div[0] = 1
-    div[window_size:] = window_size
-    for i in range(window_size):
-        avg[window_size - 1 :] += data[i : n - window_size + i + 1]
-    avg /= div
+def moving_average(data, window_size, mode="trailing"):
+    """
+    Moving average along the first axis based on cumulative sums, so it runs
+    in O(n) independent of the window size. Non-finite samples (NaN, inf) are
+    skipped and at the edges only the available samples are averaged.
+
+    Input:
+        data            array   1-D series or 2-D (date x region) array
+        window_size     int     number of samples in the window
+        mode            str     "trailing" averages the current and the
+                                preceding samples, "centered" the samples
+                                around the current one
+    """
+    data = np.asarray(data, dtype=float)
+    n = data.shape[0]
+    valid = np.isfinite(data)
+
+    # Prepend a row of zeros, so that each window sum is a single difference
+    zeros = np.zeros((1,) + data.shape[1:])
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, data, 0), axis=0)])
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+
+    if mode == "trailing":
+        hi = np.arange(1, n + 1)
+    elif mode == "centered":
+        hi = np.arange(n) - window_size // 2 + window_size
+    else:
+        raise ValueError("Unknown moving average mode '{}'".format(mode))
+    lo = np.clip(hi - window_size, 0, n)
+    hi = np.clip(hi, 0, n)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg = (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
     return avg
 
 
@@ -64,119 +229,1333 @@ def get_date_list(report_list):
     return dates
 
 
+def get_report_layout(path):
+    """
+    Returns the name of the layout of a daily report (see REPORT_LAYOUTS) and
+    its header. The name is None for unknown layouts.
+    """
+    # Some reports start with a byte order mark
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        header = tuple(next(csv.reader(f)))
+    for name, layout in REPORT_LAYOUTS.items():
+        if header == layout:
+            return name, header
+    return None, header
+
+
+def read_report(path):
+    """
+    Read the columns of a daily report that are used here, with pinned dtypes
+    and unified column names.
+    """
+    layout, header = get_report_layout(path)
+    if layout is None:
+        warnings.warn("Unknown layout of daily report {}: {}".format(path, header))
+    usecols = [c for c in header if c in REPORT_COLUMNS]
+    names = [REPORT_COLUMNS[c] for c in usecols]
+    if "Country/Region" not in names or "Confirmed" not in names:
+        raise ValueError(
+            "Daily report {} has no country or confirmed cases".format(path)
+        )
+    report = pd.read_csv(
+        path,
+        encoding="utf-8-sig",
+        usecols=usecols,
+        dtype={c: REPORT_DTYPES[REPORT_COLUMNS[c]] for c in usecols},
+    )
+    report = report.rename(columns=REPORT_COLUMNS)
+    # E.g. reports before March 22 have no county level data
+    for col in REPORT_COLUMNS.values():
+        if col not in report:
+            report[col] = np.nan
+    return report
+
+
 def get_dataframe_from_csv_file(path, date, no_provinces=True):
-    report = pd.read_csv(path, delimiter=",")
-    # Fix inconsistency that has been introduced on March 23
-    try:
-        report.rename(columns={"Country_Region": "Country/Region"}, inplace=True)
-        report.rename(columns={"Province_State": "Province/State"}, inplace=True)
-    except:
-        pass
-
-    # United Kingdom is UK
-    report.loc[report["Country/Region"] == "United Kingdom", "Country/Region"] = "UK"
-
-    # Mainland China is China
-    report.loc[report["Country/Region"] == "Mainland China", "Country/Region"] = "China"
-
-    # Korea, South is South Korea
-    report.loc[
-        report["Country/Region"] == "Korea, South", "Country/Region"
-    ] = "South Korea"
-
-    # Sum over all provinces that belong to a country/region
-    for c in report["Country/Region"].unique():
-        provinces = report[report["Country/Region"] == c]["Province/State"].unique()
-        if any(pd.isna(provinces)):
-            # There is one entry for the whole country without a specific province
-            pass
-        else:
-            # There is no entry for the entire country, we have to sum over all provinces
-            report = report.append(
-                pd.DataFrame(
-                    {
-                        "Country/Region": c,
-                        "Province/State": np.nan,
-                        "Confirmed": report[report["Country/Region"] == c][
-                            "Confirmed"
-                        ].sum(),
-                        "Deaths": report[report["Country/Region"] == c]["Deaths"].sum(),
-                        "Recovered": report[report["Country/Region"] == c][
-                            "Recovered"
-                        ].sum(),
-                    },
-                    index=[0],
-                ),
-                ignore_index=False,
-            )
+    report = read_report(path)
+
+    # E.g. United Kingdom is UK
+    report["Country/Region"] = report["Country/Region"].replace(COUNTRY_ALIASES)
+
+    report = add_country_totals(report, ["Confirmed", "Deaths", "Recovered"])
 
     # Remove the provice data
     if no_provinces:
         report = report[pd.isna(report["Province/State"])]
+    else:
+        report = add_province_totals(report)
+    report["Region"] = get_region_ids(report)
 
     # Add date and append
     report["Date"] = [date for i in range(len(report))]
     return report
 
 
-def get_data(path_name, no_provinces=True):
+def add_country_totals(report, columns):
+    """
+    Sum columns over all provinces that belong to a country/region. Countries
+    with an entry for the whole country (without a specific province) are
+    skipped, for all others we have to sum over all provinces.
+    """
+    no_province = report["Province/State"].isna()
+    has_total = no_province.groupby(
+        report["Country/Region"], observed=True
+    ).transform("any")
+    totals = (
+        report[~has_total]
+        .groupby("Country/Region", sort=False, observed=True)[columns]
+        .sum()
+        .reset_index()
+    )
+    totals["Province/State"] = np.nan
+    return pd.concat([report, totals], ignore_index=True)
+
+
+def add_province_totals(report):
+    """
+    Sum over all Admin2 regions (e.g. US counties) of provinces that have no
+    entry for the whole province.
+    """
+    in_province = report[report["Province/State"].notna()]
+    no_admin2 = in_province["Admin2"].isna()
+    has_total = no_admin2.groupby(
+        [in_province["Country/Region"], in_province["Province/State"]], observed=True
+    ).transform("any")
+    totals = (
+        in_province[~has_total]
+        .groupby(["Country/Region", "Province/State"], sort=False, observed=True)[
+            ["Confirmed", "Deaths", "Recovered"]
+        ]
+        .sum()
+        .reset_index()
+    )
+    totals["Admin2"] = np.nan
+    return pd.concat([report, totals], ignore_index=True)
+
+
+def get_region_ids(report):
+    """
+    Hierarchical region IDs, e.g. "US", "US/New York" and "US/New York/Kings"
+    for a country, a province and an Admin2 region.
+    """
+    ids = report["Country/Region"].astype(str)
+    for col in REGION_COLUMNS[1:]:
+        level = get_region_column(report, col)
+        ids = ids.where(level.isna(), ids + REGION_SEP + level.astype(str))
+    return ids
+
+
+def get_region_level(report):
+    # 0 for countries, 1 for provinces, 2 for Admin2 regions
+    province = get_region_column(report, "Province/State")
+    admin2 = get_region_column(report, "Admin2")
+    return province.notna().astype(int) + admin2.notna().astype(int)
+
+
+def get_region_column(report, col):
+    # Data without provinces or Admin2 regions, e.g. of the reports before
+    # 03-22-2020, may lack the column, which is the same as all NaN
+    if col in report:
+        return report[col]
+    return pd.Series(np.nan, index=report.index)
+
+
+def get_report_fingerprint(path):
+    report_stat = stat(path)
+    return {"size": report_stat.st_size, "mtime": report_stat.st_mtime}
+
+
+def get_report_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, path):
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def get_changed_reports(path_name, manifest):
+    """
+    Compare the daily reports in path_name with the manifest of already
+    ingested reports. The content hash is only computed if size or mtime
+    differ from the manifest entry, e.g. after a fresh clone touched all files.
+
+    Input:
+        path_name   str     directory containing the daily reports
+        manifest    dict    report name -> {"size", "mtime", "sha1"}, and
+                            MANIFEST_OPTIONS -> options of the ingest
+
+    Returns:
+        changed     list    reports that are new or whose content changed
+        removed     list    reports in the manifest that do not exist anymore
+        manifest    dict    manifest describing the current directory content,
+                            without options
+    """
+    changed = []
+    new_manifest = {}
+    for rn in get_report_list(path_name):
+        entry = get_report_fingerprint(join(path_name, rn))
+        old_entry = manifest.get(rn)
+        if (
+            old_entry is not None
+            and old_entry["size"] == entry["size"]
+            and old_entry["mtime"] == entry["mtime"]
+        ):
+            new_manifest[rn] = old_entry
+            continue
+        entry["sha1"] = get_report_hash(join(path_name, rn))
+        if old_entry is None or old_entry.get("sha1") != entry["sha1"]:
+            changed.append(rn)
+        new_manifest[rn] = entry
+    removed = [
+        rn for rn in manifest if rn != MANIFEST_OPTIONS and rn not in new_manifest
+    ]
+    return changed, removed, new_manifest
+
+
+def get_ingest_options(data, manifest):
+    """
+    Returns the options data was ingested with, as recorded in its manifest by
+    update_data. Older manifests do not record them, then they are derived
+    from data.
+    """
+    if MANIFEST_OPTIONS in manifest:
+        return manifest[MANIFEST_OPTIONS]
+    return {"no_provinces": not (get_region_level(data) > 0).any()}
+
+
+class ReportBuffer:
+    """
+    Columnar buffer the parsed daily reports get appended to one by one,
+    instead of keeping a list of DataFrames and concatenating them at the end.
+    The four names are stored as int32 category codes, the date and the three
+    counts as int64, i.e. 48 bytes per row. The arrays grow by doubling, so
+    the memory ceiling while loading is about 2 x 48 bytes per row plus the
+    reports that are currently parsed (one, or 2 x processes in read_reports),
+    and to_frame adds another 48 bytes per row.
+    """
+
+    name_columns = ["Region"] + REGION_COLUMNS
+    count_columns = ["Confirmed", "Deaths", "Recovered"]
+
+    def __init__(self, capacity=1 << 16):
+        self.size = 0
+        self.categories = {col: {} for col in self.name_columns}
+        self.arrays = {col: np.empty(capacity, np.int32) for col in self.name_columns}
+        self.arrays["Date"] = np.empty(capacity, "datetime64[ns]")
+        for col in self.count_columns:
+            self.arrays[col] = np.empty(capacity, np.int64)
+
+    def reserve(self, n):
+        capacity = len(self.arrays["Date"])
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for col, array in self.arrays.items():
+            grown = np.empty(capacity, array.dtype)
+            grown[: self.size] = array[: self.size]
+            self.arrays[col] = grown
+
+    def append(self, report):
+        n = len(report)
+        self.reserve(n)
+        rows = slice(self.size, self.size + n)
+        for col in self.name_columns:
+            # Translate the codes of this report to the codes of the buffer,
+            # NaN stays -1 like in pandas Categoricals
+            local_codes, uniques = pd.factorize(report[col])
+            categories = self.categories[col]
+            to_global = np.array(
+                [categories.setdefault(u, len(categories)) for u in uniques] + [-1],
+                dtype=np.int32,
+            )
+            self.arrays[col][rows] = to_global[local_codes]
+        self.arrays["Date"][rows] = pd.to_datetime(report["Date"]).to_numpy(
+            dtype="datetime64[ns]"
+        )
+        for col in self.count_columns:
+            counts = report[col].to_numpy(dtype=float, na_value=np.nan)
+            # Missing counts in the early reports mean zero
+            self.arrays[col][rows] = np.nan_to_num(counts)
+        self.size += n
+
+    def to_frame(self):
+        data = {}
+        for col in DATA_COLUMNS:
+            values = self.arrays[col][: self.size]
+            if col in self.categories:
+                values = pd.Categorical.from_codes(
+                    values, categories=list(self.categories[col])
+                )
+            data[col] = values
+        return pd.DataFrame(data, columns=DATA_COLUMNS)
+
+
+def read_reports(path_name, report_names, no_provinces=True, processes=1):
+    # Append the reports in date order, so that the data needs no sorting
+    report_names = sorted(report_names, key=lambda rn: get_date_list([rn])[0])
+    dates = get_date_list(report_names)
+    paths = [path_name + rn for rn in report_names]
+
+    # Each report gets reduced to the used columns while parsing and appended
+    # to the buffer right away
+    data = ReportBuffer()
+    if processes > 1:
+        # The reports are independent. Only 2 x processes of them are in
+        # flight at a time, so that parsed reports cannot pile up when the
+        # workers are faster than the buffer. Appending in submission order
+        # keeps them in the same order as in the serial case.
+        jobs = zip(paths, dates)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            pending = deque(
+                executor.submit(get_dataframe_from_csv_file, p, d, no_provinces)
+                for p, d in islice(jobs, 2 * processes)
+            )
+            while pending:
+                report = pending.popleft().result()
+                for p, d in islice(jobs, 1):
+                    pending.append(
+                        executor.submit(get_dataframe_from_csv_file, p, d, no_provinces)
+                    )
+                data.append(report)
+    else:
+        for d, p in zip(dates, paths):
+            # print(d)
+            # Read report
+            data.append(get_dataframe_from_csv_file(p, d, no_provinces))
+    return data.to_frame()
+
+
+def get_data(path_name, no_provinces=True, processes=1):
     # Get a file list of daily reports
     report_names = get_report_list(path_name)
-    dates = get_date_list(report_names)
+    return read_reports(path_name, report_names, no_provinces, processes)
+
 
-    # Create merged dataframe
-    data = []
-    for d, rn in zip(dates, report_names):
-        # print(d)
-        # Read report
-        report = get_dataframe_from_csv_file(path_name + rn, d, no_provinces)
-        data.append(report)
-
-    # Concatenate to one dataframe
-    data = pd.concat(data)
-    data.Date = pd.to_datetime(data.Date)
+def get_data_from_time_series(path_name, no_provinces=True):
+    """
+    Build the data set from the wide time series files of the CSSE
+    repository, which hold the full history in three files. They contain no
+    Admin2 level data.
+    """
+    keys = ["Province/State", "Country/Region", "Date"]
+    data = None
+    for col, fname in TIME_SERIES_FILES.items():
+        wide = pd.read_csv(join(path_name, fname))
+        wide = wide.drop(columns=["Lat", "Long"])
+        wide["Country/Region"] = wide["Country/Region"].replace(COUNTRY_ALIASES)
+        date_columns = list(wide.columns[2:])
+
+        # Sum over the provinces for all dates at once, before going to long
+        # format. This has to happen per file, because they don't contain the
+        # same provinces, e.g. Canada's recovered cases are country-wide.
+        wide = add_country_totals(wide, date_columns)
+        if no_provinces:
+            wide = wide[pd.isna(wide["Province/State"])]
+
+        series = wide.melt(
+            id_vars=keys[:2], value_vars=date_columns, var_name="Date", value_name=col
+        )
+        if data is None:
+            data = series
+        else:
+            data = data.merge(series, on=keys, how="outer")
+
+    data["Date"] = pd.to_datetime(data["Date"], format="%m/%d/%y")
+    data["Admin2"] = np.nan
+    data["Region"] = get_region_ids(data)
     data = data.sort_values("Date")
     return data
 
 
+def compare_data(data, other, columns=("Confirmed", "Deaths")):
+    """
+    Cross-check two data sets, e.g. built from the daily reports and from the
+    time series files, on their common regions and dates.
+
+    Returns:
+        mismatches  DataFrame   Region, Date, column and both values of all
+                                differing entries
+    """
+    store = get_store(data)
+    other = get_store(other)
+    regions = [r for r in store.regions if r in other.region_index]
+    dates = store.dates.intersection(other.dates)
+    rows = store.dates.get_indexer(dates)
+    other_rows = other.dates.get_indexer(dates)
+    cols = [store.region_index[r] for r in regions]
+    other_cols = [other.region_index[r] for r in regions]
+
+    mismatches = []
+    for col in columns:
+        a = store.series[col][np.ix_(rows, cols)]
+        b = other.series[col][np.ix_(other_rows, other_cols)]
+        # Only compare dates that are reported in both data sets
+        i, j = np.nonzero((a != b) & ~np.isnan(a) & ~np.isnan(b))
+        mismatches.append(
+            pd.DataFrame(
+                {
+                    "Region": np.array(regions, dtype=object)[j],
+                    "Date": dates[i],
+                    "Column": col,
+                    "Value": a[i, j],
+                    "Other": b[i, j],
+                }
+            )
+        )
+    return pd.concat(mismatches, ignore_index=True)
+
+
+def update_data(
+    path_name, data, manifest, no_provinces=True, processes=1, changes=None
+):
+    """
+    Incrementally update data with the daily reports in path_name. Only
+    reports that are new or changed according to the manifest get parsed, all
+    rows of changed or removed reports are replaced. If data was ingested with
+    other options, e.g. with provinces, all reports get parsed again.
+
+    Input:
+        path_name       str         directory containing the daily reports
+        data            DataFrame   previously ingested data or None
+        manifest        dict        manifest belonging to data, see
+                                    get_changed_reports
+        processes       int         number of worker processes for parsing
+        changes         tuple       result of get_changed_reports for
+                                    manifest, if it is already known
+
+    Returns:
+        data            DataFrame   updated data
+        manifest        dict        updated manifest
+    """
+    options = {"no_provinces": no_provinces}
+    if data is not None and get_ingest_options(data, manifest) != options:
+        warnings.warn(
+            "The data was ingested with other options than {}, all daily "
+            "reports get parsed again".format(options)
+        )
+        data = None
+    if data is None:
+        # Without data, the manifest is meaningless
+        manifest = {}
+        changes = None
+    if changes is None:
+        changes = get_changed_reports(path_name, manifest)
+    changed, removed, manifest = changes
+    manifest[MANIFEST_OPTIONS] = options
+    if data is not None and (changed or removed):
+        # Every report holds exactly one date, so drop its rows before merging
+        stale_dates = pd.to_datetime(get_date_list(changed + removed))
+        data = data[~data.Date.isin(stale_dates)]
+    if changed:
+        reports = read_reports(path_name, changed, no_provinces, processes)
+        if data is not None:
+            reports = pd.concat([data, reports])
+        data = reports.sort_values("Date")
+    return data, manifest
+
+
+def refresh_data(path_name, data, manifest, no_provinces=True, processes=1):
+    """
+    Ingests new or changed daily reports like --data --incremental, i.e.
+    data.feather and its manifest get updated.
+
+    Returns:
+        data        DataFrame   updated data, None if no report changed
+        manifest    dict        updated manifest
+        dates       DatetimeIndex   dates of the new, changed or removed
+                                    reports
+    """
+    options = {"no_provinces": no_provinces}
+    rebuild = data is not None and get_ingest_options(data, manifest) != options
+    changes = get_changed_reports(path_name, manifest)
+    changed, removed, _ = changes
+    if not changed and not removed and not rebuild:
+        return None, manifest, pd.DatetimeIndex([])
+    old_dates = data.Date.unique() if rebuild else []
+    data, manifest = update_data(
+        path_name,
+        data,
+        manifest,
+        no_provinces=no_provinces,
+        processes=processes,
+        changes=changes,
+    )
+    # The in-memory frame stays in use, feather files can only be rewritten
+    data = normalize_data(data)
+    save_data(data, PATH_DATA)
+    save_manifest(manifest, PATH_MANIFEST)
+    dates = pd.to_datetime(get_date_list(changed + removed))
+    if rebuild:
+        # Every report got parsed again
+        dates = pd.DatetimeIndex(old_dates).union(data.Date.unique())
+    return data, manifest, dates
+
+
+def watch_reports(path_name, on_change, interval=10, debounce=10, stopped=None):
+    """
+    Polls the daily reports and calls on_change once changes have settled,
+    i.e. when the directory did not change for debounce seconds. A burst of
+    changes, e.g. a git pull, results in a single call. Only size and mtime of
+    the reports get compared, see get_report_fingerprint. The first poll
+    always counts as a change, so that reports that arrived before the
+    watching started are picked up.
+
+    Input:
+        path_name   str     directory containing the daily reports
+        on_change   callable    called without arguments
+        interval    float   seconds between two polls
+        debounce    float   seconds without changes before calling on_change
+        stopped     threading.Event     stops watching when set
+    """
+    if stopped is None:
+        stopped = threading.Event()
+    state = None
+    changed_at = None
+    while not stopped.wait(interval):
+        new_state = {
+            rn: get_report_fingerprint(join(path_name, rn))
+            for rn in get_report_list(path_name)
+        }
+        if new_state != state:
+            state = new_state
+            changed_at = time.monotonic()
+        elif changed_at is not None and time.monotonic() - changed_at >= debounce:
+            changed_at = None
+            try:
+                on_change()
+            except Exception as e:
+                warnings.warn("Processing the changed reports failed: {}".format(e))
+
+
+DATA_COLUMNS = [
+    "Date",
+    "Region",
+    "Country/Region",
+    "Province/State",
+    "Admin2",
+    "Confirmed",
+    "Deaths",
+    "Recovered",
+]
+
+
+def normalize_data(data):
+    # Pin the dtypes of the columns that are used by the analysis
+    data = data.reindex(columns=DATA_COLUMNS).reset_index(drop=True)
+    data["Date"] = pd.to_datetime(data["Date"])
+    if data["Region"].isna().any():
+        # Data stored before the region IDs were introduced
+        data["Region"] = get_region_ids(data)
+    for col in ["Region"] + REGION_COLUMNS:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            data[col] = data[col].cat.remove_unused_categories()
+        else:
+            # Go via object, otherwise all-NaN columns get float categories
+            data[col] = data[col].astype(object).astype("category")
+    for col in ["Confirmed", "Deaths", "Recovered"]:
+        # Missing counts in the early reports mean zero
+        data[col] = data[col].fillna(0).astype("int64")
+    return data
+
+
+def save_data(data, path):
+    """
+    Store data in a columnar Feather file or, if path ends with .csv, as text.
+    """
+    data = normalize_data(data)
+    if path.endswith(".csv"):
+        data.to_csv(path, index=False)
+    else:
+        feather.write_feather(data, path)
+
+
+def load_data(path):
+    """
+    Load data stored by save_data. Feather files are memory-mapped and keep
+    their dtypes, CSV files get parsed and normalized.
+    """
+    if path.endswith(".csv"):
+        data = pd.read_csv(path, parse_dates=["Date"])
+        return normalize_data(data)
+    data = feather.read_table(path, memory_map=True).to_pandas()
+    if list(data.columns) != DATA_COLUMNS:
+        # Stored by an older version
+        data = normalize_data(data)
+    return data
+
+
+class TimeSeriesStore:
+    """
+    Wide date x region arrays of the cumulative counts. It gets built once
+    from the long-format data, afterwards every series is a column lookup
+    instead of a scan over the whole data set. The regions are keyed by their
+    hierarchical ID (see get_region_ids), which is simply the name for a
+    country. Dates on which a region has no report are NaN, duplicate rows of
+    the same region and date are summed.
+
+    Input:
+        data    DataFrame   long-format data
+        level   int         only use countries (0), provinces (1) or Admin2
+                            regions (2). If None, all regions are used.
+    """
+
+    columns = ["Confirmed", "Deaths", "Recovered"]
+
+    def __init__(self, data, level=None):
+        if "Region" not in data:
+            data = data.assign(Region=get_region_ids(data))
+        if level is not None:
+            data = data[get_region_level(data) == level]
+        region_codes, regions = pd.factorize(data["Region"])
+        date_codes, dates = pd.factorize(data["Date"], sort=True)
+        shape = (len(dates), len(regions))
+
+        # Scatter the rows into the date x region arrays
+        cells = date_codes * shape[1] + region_codes
+        reported = np.bincount(cells, minlength=shape[0] * shape[1]) > 0
+        self.series = {}
+        for col in self.columns:
+            values = np.bincount(
+                cells,
+                weights=data[col].to_numpy(dtype=float, na_value=0),
+                minlength=shape[0] * shape[1],
+            )
+            values[~reported] = np.nan
+            self.series[col] = values.reshape(shape)
+        self._set_index(pd.to_datetime(dates), list(regions))
+
+    def _set_index(self, dates, regions):
+        self.dates = dates
+        self.regions = regions
+        self.region_index = {r: i for i, r in enumerate(self.regions)}
+        self.metrics = None
+        self.trends = {}
+        self.growth = {}
+        self.seir = {}
+
+    def update(self, reports, dates):
+        """
+        Returns a store which differs from this one only by the reports of
+        dates, see refresh_data. Only the rows of the new reports get
+        scattered, the rows of the other dates are copied. The derived metrics
+        are computed again on first use.
+
+        Input:
+            reports     DataFrame   long-format rows of the new or changed
+                                    reports
+            dates       list        dates of the new, changed or removed
+                                    reports
+        """
+        new = TimeSeriesStore(reports)
+        kept = ~self.dates.isin(pd.DatetimeIndex(dates))
+        dates = self.dates[kept].union(new.dates)
+        regions = list(self.regions)
+        index = dict(self.region_index)
+        for r in new.regions:
+            if r not in index:
+                index[r] = len(regions)
+                regions.append(r)
+        old_rows = dates.get_indexer(self.dates[kept])
+        new_rows = dates.get_indexer(new.dates)
+        new_cols = [index[r] for r in new.regions]
+
+        series = {}
+        reported = np.zeros(len(regions), dtype=bool)
+        for col in self.columns:
+            values = np.full((len(dates), len(regions)), np.nan)
+            values[old_rows, : len(self.regions)] = self.series[col][kept]
+            values[np.ix_(new_rows, new_cols)] = new.series[col]
+            reported |= ~np.isnan(values).all(axis=0)
+            series[col] = values
+        # Drop the regions which were only reported on removed dates
+        store = TimeSeriesStore.__new__(TimeSeriesStore)
+        store.series = {col: values[:, reported] for col, values in series.items()}
+        store._set_index(dates, [r for r, k in zip(regions, reported) if k])
+        return store
+
+    def get_regions(self, level=None):
+        """
+        Returns the IDs of all regions or of all regions of the given level.
+        """
+        if level is None:
+            return list(self.regions)
+        return [r for r in self.regions if r.count(REGION_SEP) == level]
+
+    def get_series(self, country, column):
+        """
+        Returns the dates and values of column for a country or region ID,
+        skipping the dates without a report.
+        """
+        if country not in self.region_index:
+            return np.array([], dtype="datetime64[ns]"), np.array([])
+        values = self.series[column][:, self.region_index[country]]
+        reported = ~np.isnan(values)
+        return np.array(self.dates[reported]), values[reported]
+
+    def get_metrics(self):
+        # All metrics get computed on first use
+        if self.metrics is None:
+            self.metrics = compute_metrics(self)
+        return self.metrics
+
+    def get_metric(self, country, metric):
+        """
+        Returns the dates and values of a derived series for a country or
+        region ID, see compute_metrics.
+        """
+        if country not in self.region_index:
+            return np.array([], dtype="datetime64[ns]"), np.array([])
+        i = self.region_index[country]
+        dates, values, lengths = self.get_metrics()[metric]
+        return dates[: lengths[i], i], values[: lengths[i], i]
+
+    def get_trends(self, metric, ext_base, forecast):
+        # The trends of all regions get fitted at once and cached
+        key = (metric, ext_base, forecast)
+        if key not in self.trends:
+            self.trends[key] = compute_log_trends(
+                self.get_metrics()[metric], ext_base, forecast
+            )
+        return self.trends[key]
+
+    def get_growth(self, metric, window, confidence=0.95):
+        # The growth rates of all regions and dates get computed at once and
+        # cached
+        key = (metric, window, confidence)
+        if key not in self.growth:
+            self.growth[key] = compute_growth(
+                self.get_metrics()[metric], window, confidence
+            )
+        return self.growth[key]
+
+    def get_seir(self, incubation=5.2, infectious=7.0, processes=1):
+        # The SEIR models of all regions get fitted at once and cached
+        key = (incubation, infectious)
+        if key not in self.seir:
+            self.seir[key] = compute_seir(
+                self, incubation=incubation, infectious=infectious, processes=processes
+            )
+        return self.seir[key]
+
+    def get_forecast(self, country, metric, ext_base, forecast):
+        """
+        Returns the dates and values of the log-linear extrapolation of a
+        metric for a country or region ID, see compute_log_trends. The dates
+        start ext_base days before the last report and end forecast days after
+        it. The extrapolation is scale invariant, i.e. it can be multiplied by
+        the same factor as the series.
+        """
+        if country not in self.region_index:
+            return pd.DatetimeIndex([]), np.array([])
+        i = self.region_index[country]
+        trends = self.get_trends(metric, ext_base, forecast)
+        last_date = trends["last_date"][i]
+        if pd.isna(last_date):
+            # The metric has no values for the region
+            return pd.DatetimeIndex([]), np.array([])
+        ext_range = pd.date_range(
+            last_date - pd.Timedelta(ext_base, unit="d"),
+            last_date + pd.Timedelta(forecast, unit="d"),
+        )
+        return ext_range, trends["forecast"][:, i]
+
+
+def compute_metrics(store):
+    """
+    Computes the derived series of all countries at once on 2-D arrays. The
+    arrays are in report order, i.e. row k holds the k-th report of every
+    country, so the differences are taken between consecutive reports exactly
+    like in the per-country series, even if a country misses some dates.
+
+    Returns:
+        metrics     dict    metric name -> (dates, values, lengths), where
+                            lengths holds the number of valid rows per country
+    """
+    valid = ~np.isnan(store.series["Confirmed"])
+    # Move the reported values of each country to the top, keeping their order
+    order = np.argsort(~valid, axis=0, kind="stable")
+    n = valid.sum(axis=0)
+    dates = np.asarray(store.dates)[order]
+    confirmed = np.take_along_axis(store.series["Confirmed"], order, axis=0)
+    deaths = np.take_along_axis(store.series["Deaths"], order, axis=0)
+
+    new_infections = confirmed[1:] - confirmed[:-1]
+    deaths_per_day = deaths[1:] - deaths[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spread_rate = new_infections / confirmed[:-1]
+        infection_rate = new_infections[1:] / new_infections[:-1]
+
+    return {
+        "Confirmed": (dates, confirmed, n),
+        "Deaths": (dates, deaths, n),
+        "New Infections": (dates[:-1], new_infections, np.maximum(n - 1, 0)),
+        "Deaths per Day": (dates[:-1], deaths_per_day, np.maximum(n - 1, 0)),
+        "Spread Rate": (dates[:-1], spread_rate, np.maximum(n - 1, 0)),
+        "Infection Rate": (dates[2:], infection_rate, np.maximum(n - 2, 0)),
+    }
+
+
+def compute_log_trends(metric, ext_base, forecast):
+    """
+    Fits log-linear trends to the last ext_base values of a metric for all
+    regions at once. Since the x values are the same for all regions, the
+    least-squares fit has a closed form, which gives the same result as
+    log_extrapol for each region. Regions with less than ext_base values or
+    with non-positive values get NaN.
+
+    Input:
+        metric      tuple   (dates, values, lengths) as in compute_metrics
+        ext_base    int     number of values the trend gets fitted to
+        forecast    int     number of days to extrapolate
+
+    Returns:
+        trends      dict    "slope" and "intercept" of log10(values) per day,
+                            "rate" the daily growth factor, "last_date" the
+                            date of the last value and "forecast" the
+                            extrapolation (ext_base + forecast + 1 days x
+                            regions) starting the day before the fitted values
+    """
+    dates, values, lengths = metric
+    regions = np.arange(values.shape[1])
+    if not len(values):
+        # No region has values, e.g. the differences of a single date. A row
+        # of NaN keeps the gathering valid and gives NaN trends.
+        values = np.full((1, len(regions)), np.nan)
+        dates = np.full((1, len(regions)), np.datetime64("NaT", "ns"))
+
+    # Gather the last ext_base values of each region
+    rows = np.maximum(lengths - ext_base, 0) + np.arange(ext_base)[:, None]
+    rows = np.minimum(rows, len(values) - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logy = np.log10(values[rows, regions])
+
+        x = np.arange(ext_base) - (ext_base - 1) / 2
+        logy_mean = logy.mean(axis=0)
+        slope = (x[:, None] * (logy - logy_mean)).sum(axis=0) / (x ** 2).sum()
+        intercept = logy_mean - slope * (ext_base - 1) / 2
+    slope[lengths < ext_base] = np.nan
+    intercept[lengths < ext_base] = np.nan
+
+    xx = np.arange(-1, ext_base + forecast)
+    return {
+        "slope": slope,
+        "intercept": intercept,
+        "rate": 10 ** slope,
+        "last_date": pd.to_datetime(dates[np.maximum(lengths - 1, 0), regions]),
+        "forecast": 10 ** (slope * xx[:, None] + intercept),
+    }
+
+
+def compute_rolling_log_trends(metric, ext_base):
+    """
+    The log-linear trends of compute_log_trends as they stood after every
+    report, for all reports and regions in one pass. The regression sums of
+    each window of ext_base values are differences of cumulative sums, like
+    in compute_growth.
+
+    Input:
+        metric      tuple   (dates, values, lengths) as in compute_metrics
+        ext_base    int     number of values the trend gets fitted to
+
+    Returns:
+        trends      dict    "slope" and "intercept" of log10(values) per day
+                            in the report order of metric, i.e. row k holds
+                            the trend fitted to the values up to report k.
+                            The intercept is the value at the first fitted
+                            report. Rows with less than ext_base values
+                            before them are NaN.
+    """
+    dates, values, lengths = metric
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logy = np.log10(values)
+    valid = np.isfinite(logy)
+    logy = np.where(valid, logy, 0)
+
+    zeros = np.zeros((1,) + values.shape[1:])
+
+    def window_sums(a):
+        sums = np.concatenate([zeros, np.cumsum(a, axis=0)])
+        return sums[ext_base:] - sums[:-ext_base]
+
+    start = np.arange(max(len(values) - ext_base + 1, 0))[:, None]
+    j = np.arange(len(values))[:, None]
+    n = window_sums(valid)
+    sy = window_sums(logy)
+    sxy = window_sums(j * logy) - start * sy
+    sx = ext_base * (ext_base - 1) / 2
+    sxx = ext_base * (ext_base ** 2 - 1) / 12
+
+    slope = (sxy - sx * sy / ext_base) / sxx
+    intercept = (sy - slope * sx) / ext_base
+    slope[n < ext_base] = np.nan
+    intercept[n < ext_base] = np.nan
+
+    # Align with the rows of metric
+    padding = np.full((ext_base - 1,) + values.shape[1:], np.nan)
+    return {
+        "slope": np.concatenate([padding, slope])[: len(values)],
+        "intercept": np.concatenate([padding, intercept])[: len(values)],
+    }
+
+
+def compute_growth(metric, window, confidence=0.95):
+    """
+    Rolling log-linear growth rate and doubling time for every date and
+    region in one sweep. The regression sums of each window are differences
+    of cumulative sums, i.e. they get updated incrementally as the window
+    slides instead of refitting per date. Windows with non-positive or
+    missing values are NaN.
+
+    Input:
+        metric      tuple   (dates, values, lengths) as in compute_metrics
+        window      int     number of values per fit, at least 3
+        confidence  float   level of the confidence intervals
+
+    Returns:
+        growth      dict    2-D arrays in the report order of metric, the
+                            first window - 1 rows are NaN:
+                            "rate" growth rate of ln(values) per day, its
+                            standard error "rate_se" and confidence interval
+                            "rate_lower", "rate_upper", the "doubling_time"
+                            in days (negative for halving), its standard
+                            error "doubling_time_se" and confidence interval
+                            "doubling_time_lower", "doubling_time_upper"
+                            (-inf and inf if the rate interval includes
+                            zero)
+    """
+    if window < 3:
+        raise ValueError("The growth rate needs a window of at least 3 values")
+    dates, values, lengths = metric
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logy = np.log(values)
+    valid = np.isfinite(logy)
+    logy = np.where(valid, logy, 0)
+
+    zeros = np.zeros((1,) + values.shape[1:])
+
+    def window_sums(a):
+        sums = np.concatenate([zeros, np.cumsum(a, axis=0)])
+        return sums[window:] - sums[:-window]
+
+    # Sums over x = 0 .. window - 1 within each window, with j being the row,
+    # x = j - start
+    start = np.arange(len(values) - window + 1)[:, None]
+    j = np.arange(len(values))[:, None]
+    n = window_sums(valid)
+    sy = window_sums(logy)
+    sxy = window_sums(j * logy) - start * sy
+    syy = window_sums(logy ** 2)
+    sx = window * (window - 1) / 2
+    sxx = window * (window ** 2 - 1) / 12
+
+    rate = (sxy - sx * sy / window) / sxx
+    sse = np.maximum(syy - sy ** 2 / window - rate ** 2 * sxx, 0)
+    rate_se = np.sqrt(sse / (window - 2) / sxx)
+    rate[n < window] = np.nan
+    rate_se[n < window] = np.nan
+
+    t = stats.t.ppf(0.5 + confidence / 2, window - 2)
+    growth = {
+        "rate": rate,
+        "rate_se": rate_se,
+        "rate_lower": rate - t * rate_se,
+        "rate_upper": rate + t * rate_se,
+    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth["doubling_time"] = np.log(2) / rate
+        growth["doubling_time_se"] = np.log(2) / rate ** 2 * rate_se
+        # ln(2) / rate is decreasing on either side of zero, so the bounds
+        # swap for growing as well as for halving series
+        doubling_time_lower = np.log(2) / growth["rate_upper"]
+        doubling_time_upper = np.log(2) / growth["rate_lower"]
+    # If the rate interval includes zero, the doubling time is unbounded
+    includes_zero = (growth["rate_lower"] <= 0) & (growth["rate_upper"] >= 0)
+    doubling_time_lower[includes_zero] = -np.inf
+    doubling_time_upper[includes_zero] = np.inf
+    growth["doubling_time_lower"] = doubling_time_lower
+    growth["doubling_time_upper"] = doubling_time_upper
+
+    # Align with the rows of metric
+    padding = np.full((window - 1,) + values.shape[1:], np.nan)
+    return {k: np.concatenate([padding, v]) for k, v in growth.items()}
+
+
+def integrate_seir(beta, e0, days, incubation=5.2, infectious=7.0, steps_per_day=2):
+    """
+    Integrates the SEIR model for a batch of parameters at once with the
+    classical Runge-Kutta scheme. The compartments are fractions of the
+    population, which starts susceptible except for the exposed fraction e0.
+
+    Input:
+        beta            array   transmission rates per day
+        e0              array   initially exposed fractions, same shape as beta
+        days            int     number of days
+        incubation      float   mean incubation period in days
+        infectious      float   mean infectious period in days
+        steps_per_day   int     integration steps per day
+
+    Returns:
+        exposed     array   cumulative exposed fraction 1 - S on each day
+                            (days x shape of beta)
+        removed     array   removed fraction R on each day
+    """
+    sigma = 1 / incubation
+    gamma = 1 / infectious
+    h = 1 / steps_per_day
+
+    def rates(y):
+        exposed, e, i, r = y
+        infections = beta * (1 - exposed) * i
+        return np.stack(
+            [infections, infections - sigma * e, sigma * e - gamma * i, gamma * i]
+        )
+
+    # The cumulative exposed and removed fractions are integrated directly,
+    # deriving them from S would lose their precision while they are small
+    e0 = np.asarray(e0, dtype=float)
+    y = np.stack([e0, e0, np.zeros_like(e0), np.zeros_like(e0)])
+    exposed = np.empty((days,) + e0.shape)
+    removed = np.empty((days,) + e0.shape)
+    for day in range(days):
+        exposed[day] = y[0]
+        removed[day] = y[3]
+        for _ in range(steps_per_day):
+            k1 = rates(y)
+            k2 = rates(y + h / 2 * k1)
+            k3 = rates(y + h / 2 * k2)
+            k4 = rates(y + h * k3)
+            y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+    return exposed, removed
+
+
+def _fit_log_scale(log_model, log_obs, valid, subscripts):
+    # Least-squares fit of log_obs by log_model plus an offset, i.e. a scale
+    # factor, for many pairs of model and observed series at once. The sums
+    # over the dates are contracted with einsum.
+    m = valid.astype(float)
+    log_obs = np.where(valid, log_obs, 0)
+    n = m.sum(axis=0)
+    sum_model = np.einsum(subscripts, log_model, m)
+    sum_model2 = np.einsum(subscripts, log_model ** 2, m)
+    sum_cross = np.einsum(subscripts, log_model, log_obs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = (log_obs.sum(axis=0) - sum_model) / n
+    sse = (log_obs ** 2).sum(axis=0) - 2 * sum_cross + sum_model2
+    sse = np.where(n > 0, sse - n * offset ** 2, 0)
+    return np.maximum(sse, 0), offset
+
+
+def _fit_seir_chunk(
+    confirmed, deaths, incubation, infectious, min_cases, min_deaths, lead, rounds=3
+):
+    # See compute_seir, confirmed and deaths are days x regions
+    regions = np.arange(confirmed.shape[1])
+    valid = (confirmed >= min_cases) | (deaths >= min_deaths)
+    offset = valid.argmax(axis=0) - lead
+    # Shift the series of each region, so that its model starts on day 0
+    days = len(confirmed) + lead
+    rows = np.arange(days)[:, None] + offset
+    inside = (rows >= 0) & (rows < len(confirmed))
+    rows = np.clip(rows, 0, len(confirmed) - 1)
+    confirmed = np.where(inside, confirmed[rows, regions], np.nan)
+    deaths = np.where(inside, deaths[rows, regions], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_confirmed = np.log(confirmed)
+        log_deaths = np.log(deaths)
+    valid_confirmed = confirmed >= min_cases
+    valid_deaths = deaths >= min_deaths
+
+    def fit(beta, e0, subscripts):
+        exposed, removed = integrate_seir(beta, e0, days, incubation, infectious)
+        sse_confirmed, offset_confirmed = _fit_log_scale(
+            np.log(exposed), log_confirmed, valid_confirmed, subscripts
+        )
+        sse_deaths, offset_deaths = _fit_log_scale(
+            np.log(np.maximum(removed, 1e-300)), log_deaths, valid_deaths, subscripts
+        )
+        return sse_confirmed + sse_deaths, offset_confirmed, offset_deaths
+
+    # A coarse grid shared by all regions, scored for every region at once
+    step_r0 = np.log(1.1)
+    step_e0 = np.log(10) / 2
+    r0, e0 = np.meshgrid(
+        np.exp(np.arange(np.log(0.5), np.log(8), step_r0)),
+        np.exp(np.arange(np.log(1e-12), np.log(1e-1), step_e0)),
+    )
+    beta = r0.ravel() / infectious
+    e0 = e0.ravel()
+    sse, _, _ = fit(beta, e0, "tb,tr->br")
+    best = np.argmin(sse, axis=0)
+    log_beta = np.log(beta[best])
+    log_e0 = np.log(e0[best])
+
+    # Refine the grid around the best parameters of each region
+    steps = np.linspace(-1, 1, 5)
+    db, de = [d.ravel()[:, None] for d in np.meshgrid(steps, steps)]
+    for _ in range(rounds):
+        beta = np.exp(log_beta + db * step_r0)
+        e0 = np.minimum(np.exp(log_e0 + de * step_e0), 0.5)
+        sse, offset_confirmed, offset_deaths = fit(beta, e0, "tkr,tr->kr")
+        best = np.argmin(sse, axis=0)
+        log_beta = np.log(beta[best, regions])
+        log_e0 = np.log(e0[best, regions])
+        step_r0 /= 2
+        step_e0 /= 2
+
+    n = valid_confirmed.sum(axis=0) + valid_deaths.sum(axis=0)
+    fitted = valid_confirmed.any(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = {
+            "beta": np.exp(log_beta),
+            "e0": np.exp(log_e0),
+            "confirmed_scale": np.exp(offset_confirmed[best, regions]),
+            "deaths_scale": np.exp(offset_deaths[best, regions]),
+            "rmse": np.sqrt(sse[best, regions] / n),
+            "offset": offset.astype(float),
+        }
+    for v in result.values():
+        v[~fitted] = np.nan
+    return result
+
+
+def compute_seir(
+    store,
+    incubation=5.2,
+    infectious=7.0,
+    min_cases=10,
+    min_deaths=5,
+    lead=28,
+    processes=1,
+    chunk_size=64,
+):
+    """
+    Fits an SEIR model to the confirmed cases and deaths of all regions. The
+    confirmed cases are modelled as proportional to the cumulative exposed
+    fraction and the deaths as proportional to the removed fraction, so
+    besides the transmission rate and the initially exposed fraction only two
+    scale factors get fitted, which have a closed form in log space. The
+    model of each region starts lead days before its first report with enough
+    cases or deaths, so that regions whose data starts in the middle of the
+    epidemic fit as well. The timing of the outbreak is given by e0.
+
+    The ODEs do not depend on the region, so the trajectories of a coarse
+    parameter grid get integrated once in a vectorized batch and scored
+    against all regions at once. The grid gets refined around the best
+    parameters of each region, again integrating all regions in one batch.
+    Chunks of regions are spread across processes.
+
+    Input:
+        store       TimeSeriesStore
+        incubation  float   mean incubation period in days
+        infectious  float   mean infectious period in days
+        min_cases   int     confirmed cases below are not fitted
+        min_deaths  int     deaths below are not fitted
+        lead        int     days the model starts before the first report
+        processes   int     number of worker processes
+        chunk_size  int     number of regions fitted together
+
+    Returns:
+        seir        dict    arrays over the regions: "beta" transmission rate
+                            per day, "e0" initially exposed fraction, "R0"
+                            basic reproduction number, "confirmed_scale" and
+                            "deaths_scale" the factors between the fractions
+                            and the counts, "rmse" of the fit in log space,
+                            "offset" the start of the model in days after
+                            "start", the first date of the data. "days" is the
+                            number of days of the data. Regions without enough
+                            cases are NaN.
+    """
+    day_index = (store.dates - store.dates[0]).days
+    days = day_index[-1] + 1 if len(day_index) else 0
+    # The model runs on a daily grid, dates without reports are NaN
+    series = {}
+    for col in ["Confirmed", "Deaths"]:
+        series[col] = np.full((days, len(store.regions)), np.nan)
+        series[col][day_index] = store.series[col]
+
+    chunks = [
+        slice(a, a + chunk_size) for a in range(0, len(store.regions), chunk_size)
+    ]
+    args = (
+        [series["Confirmed"][:, c] for c in chunks],
+        [series["Deaths"][:, c] for c in chunks],
+        repeat(incubation),
+        repeat(infectious),
+        repeat(min_cases),
+        repeat(min_deaths),
+        repeat(lead),
+    )
+    if processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_fit_seir_chunk, *args))
+    else:
+        results = list(map(_fit_seir_chunk, *args))
+
+    seir = {
+        k: np.concatenate([r[k] for r in results]) if results else np.array([])
+        for k in ["beta", "e0", "confirmed_scale", "deaths_scale", "rmse", "offset"]
+    }
+    seir["R0"] = seir["beta"] * infectious
+    seir["start"] = store.dates[0] if days else None
+    seir["days"] = days
+    return seir
+
+
+def compute_lag_correlation(store, max_lag=40, mortality=0.015, avg=7):
+    """
+    Finds the delay between confirmed cases and deaths of all regions by
+    cross-correlating their daily new cases and new deaths. The correlation of
+    all lags and regions is computed at once with FFTs along the date axis of
+    the date x region arrays. The cumulative counts are carried forward over
+    dates without report, so that the series are on a daily grid, and the
+    daily numbers are averaged over avg days against the weekly reporting
+    pattern. The daily numbers until the first report of a region are
+    unknown, so that the counts accumulated until then do not show up as a
+    single jump.
+
+    Input:
+        store       TimeSeriesStore
+        max_lag     int     largest lag in days
+        mortality   float   assumed fraction of cases that die
+        avg         int     number of days of the moving average
+
+    Returns:
+        lags        dict    "correlation" of deaths following cases by 0 ..
+                            max_lag days (lags x regions), the Pearson
+                            correlation of the dates known in both, the best
+                            "lag" and its "max_correlation" per region and the
+                            implied "detected_fraction", i.e. the confirmed
+                            cases lag days before the last date relative to
+                            the cases estimated from the deaths at that date
+    """
+    day_index = (store.dates - store.dates[0]).days
+    days = int(day_index[-1]) + 1 if len(day_index) else 0
+    max_lag = min(max_lag, max(days - 1, 0))
+    regions = np.arange(len(store.regions))
+
+    cumulative = {}
+    new = {}
+    for col in ["Confirmed", "Deaths"]:
+        values = np.full((days, len(regions)), np.nan)
+        values[day_index] = store.series[col]
+        # Carry the last report forward and the first report backward
+        reported = ~np.isnan(values)
+        first = reported.argmax(axis=0)
+        rows = np.where(reported, np.arange(days)[:, None], 0)
+        rows = np.maximum(np.maximum.accumulate(rows, axis=0), first)
+        cumulative[col] = np.nan_to_num(values[rows, regions])
+        # The daily numbers until the first report are unknown
+        daily = np.diff(cumulative[col], axis=0, prepend=cumulative[col][:1])
+        daily[np.arange(days)[:, None] <= first] = np.nan
+        new[col] = moving_average(daily, avg)
+
+    # Zero padding to at least twice the length avoids circular wrap-around
+    n = 1 << max(2 * days - 1, 1).bit_length()
+
+    def cross_sums(x, y):
+        # Sums of x[t] * y[t + lag] over t for all lags at once, from the
+        # spectra of x and y
+        return np.fft.irfft(np.conj(x) * y, n, axis=0)[: max_lag + 1]
+
+    # The Pearson correlation of each lag only uses the dates where both
+    # series are known, every sum over them is a cross-correlation with the
+    # masks. Centering and scaling first keeps the sums precise, the
+    # correlation does not depend on it.
+    a, b = new["Confirmed"], new["Deaths"]
+    mask_a, mask_b = np.isfinite(a).astype(float), np.isfinite(b).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        a = np.nan_to_num((a - np.nanmean(a, axis=0)) / np.nanstd(a, axis=0))
+        b = np.nan_to_num((b - np.nanmean(b, axis=0)) / np.nanstd(b, axis=0))
+    a, b, aa, bb, mask_a, mask_b = [
+        np.fft.rfft(x, n, axis=0) for x in [a, b, a ** 2, b ** 2, mask_a, mask_b]
+    ]
+    count = np.round(cross_sums(mask_a, mask_b))
+    sum_a = cross_sums(a, mask_b)
+    sum_b = cross_sums(mask_a, b)
+    sum_aa = cross_sums(aa, mask_b)
+    sum_bb = cross_sums(mask_a, bb)
+    sum_ab = cross_sums(a, b)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = sum_ab - sum_a * sum_b / count
+        variance_a = np.maximum(sum_aa - sum_a ** 2 / count, 0)
+        variance_b = np.maximum(sum_bb - sum_b ** 2 / count, 0)
+        correlation = covariance / np.sqrt(variance_a * variance_b)
+    # Too few overlapping dates give meaningless correlations
+    correlation[count < 2 * avg] = np.nan
+
+    lag = np.argmax(np.nan_to_num(correlation, nan=-np.inf), axis=0)
+    max_correlation = correlation[lag, regions]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        detected_fraction = (
+            cumulative["Confirmed"][days - 1 - lag, regions]
+            * mortality
+            / cumulative["Deaths"][-1]
+        )
+    undefined = np.isnan(max_correlation)
+    return {
+        "correlation": correlation,
+        "lag": np.where(undefined, np.nan, lag),
+        "max_correlation": max_correlation,
+        "detected_fraction": np.where(undefined, np.nan, detected_fraction),
+    }
+
+
+# Stores built from long-format data by the id of the DataFrame, see get_store
+_stores = {}
+
+
+def get_store(data):
+    """
+    Accepts both, the long-format data and an already built store. The store
+    of a DataFrame is built once and kept as long as the DataFrame exists, so
+    the accessors do not rebuild it on every call. The DataFrame must not be
+    modified in place afterwards.
+    """
+    if isinstance(data, TimeSeriesStore):
+        return data
+    key = id(data)
+    if key not in _stores:
+        _stores[key] = TimeSeriesStore(data)
+        # The id can be reused once the DataFrame is gone
+        weakref.finalize(data, _stores.pop, key, None)
+    return _stores[key]
+
+
 def get_spread_rate_by_country(country, data):
-    data_country = data[data["Country/Region"] == country]
-    # Make sure, it's sorted
-    data_country = data_country.sort_values("Date")
-    confirmed = np.array(data_country.Confirmed)
-    date = np.array(data_country.Date)
-    infections = confirmed[1:] - confirmed[:-1]
-    rate = infections / confirmed[:-1]
-    date = date[:-1]
+    date, rate = get_store(data).get_metric(country, "Spread Rate")
     ts = pd.DataFrame()
     ts["Rate"] = rate
     ts["Date"] = date
     ts["Date"] = pd.to_datetime(date)
     return ts
 
+
 def get_infection_rate_by_country(country, data):
-    data_country = data[data["Country/Region"] == country]
-    # Make sure, it's sorted
-    data_country = data_country.sort_values("Date")
-    confirmed = np.array(data_country.Confirmed)
-    date = np.array(data_country.Date)
-    infections = confirmed[1:] - confirmed[:-1]
-    rate = infections[1:]/infections[:-1]
-    date = date[2:]
+    date, rate = get_store(data).get_metric(country, "Infection Rate")
     ts = pd.DataFrame()
     ts["Rate"] = rate
     ts["Date"] = date
     ts["Date"] = pd.to_datetime(date)
     return ts
 
+
 def get_new_infections_by_country(country, data):
-    data_country = data[data["Country/Region"] == country]
-    # Make sure, it's sorted
-    data_country = data_country.sort_values("Date")
-    confirmed = np.array(data_country.Confirmed)
-    date = np.array(data_country.Date)
-    infections = confirmed[1:] - confirmed[:-1]
-    date = date[:-1]
+    date, infections = get_store(data).get_metric(country, "New Infections")
     ts = pd.DataFrame()
     ts["New Infections"] = infections
     ts["Date"] = date
@@ -185,11 +1564,7 @@ def get_new_infections_by_country(country, data):
 
 
 def get_confirmed_by_country(country, data):
-    data_country = data[data["Country/Region"] == country]
-    # Make sure, it's sorted
-    data_country = data_country.sort_values("Date")
-    confirmed = np.array(data_country.Confirmed)
-    date = np.array(data_country.Date)
+    date, confirmed = get_store(data).get_series(country, "Confirmed")
     # infections = confirmed[1:] - confirmed[:-1]
     # rate = infections/confirmed[:-1]
     # date = date[:-1]
@@ -201,11 +1576,7 @@ def get_confirmed_by_country(country, data):
 
 
 def get_deaths_by_country(country, data):
-    data_country = data[data["Country/Region"] == country]
-    # Make sure, it's sorted
-    data_country = data_country.sort_values("Date")
-    deaths = np.array(data_country.Deaths)
-    date = np.array(data_country.Date)
+    date, deaths = get_store(data).get_series(country, "Deaths")
     # infections = confirmed[1:] - confirmed[:-1]
     # rate = infections/confirmed[:-1]
     # date = date[:-1]
@@ -216,6 +1587,87 @@ def get_deaths_by_country(country, data):
     return ts
 
 
+def get_growth_rate_by_country(country, data, window=7, metric="Confirmed"):
+    data = get_store(data)
+    date, _ = data.get_metric(country, metric)
+    if len(date) < window:
+        date = date[:0]
+    ts = pd.DataFrame()
+    if country in data.region_index:
+        growth = data.get_growth(metric, window)
+        rows = slice(window - 1, len(date))
+        i = data.region_index[country]
+        ts["Rate"] = growth["rate"][rows, i]
+        ts["Rate SE"] = growth["rate_se"][rows, i]
+        ts["Rate Lower"] = growth["rate_lower"][rows, i]
+        ts["Rate Upper"] = growth["rate_upper"][rows, i]
+        ts["Doubling Time"] = growth["doubling_time"][rows, i]
+        ts["Doubling Time SE"] = growth["doubling_time_se"][rows, i]
+        ts["Doubling Time Lower"] = growth["doubling_time_lower"][rows, i]
+        ts["Doubling Time Upper"] = growth["doubling_time_upper"][rows, i]
+    ts["Date"] = pd.to_datetime(date[window - 1 :])
+    return ts
+
+
+def get_seir_by_country(country, data, forecast=21, incubation=5.2, infectious=7.0):
+    """
+    Returns the confirmed cases and deaths of the SEIR model fitted to a
+    country or region ID, see compute_seir, from the start of its model until
+    forecast days after the last date of the data.
+    """
+    data = get_store(data)
+    ts = pd.DataFrame()
+    if country not in data.region_index:
+        ts["Confirmed"] = []
+        ts["Deaths"] = []
+        ts["Date"] = pd.to_datetime([])
+        return ts
+    i = data.region_index[country]
+    seir = data.get_seir(incubation, infectious)
+    offset = 0 if np.isnan(seir["offset"][i]) else int(seir["offset"][i])
+    days = seir["days"] - offset + forecast
+    exposed, removed = integrate_seir(
+        seir["beta"][i], seir["e0"][i], days, incubation, infectious
+    )
+    ts["Confirmed"] = seir["confirmed_scale"][i] * exposed
+    ts["Deaths"] = seir["deaths_scale"][i] * removed
+    ts["Date"] = pd.date_range(seir["start"] + pd.Timedelta(days=offset), periods=days)
+    return ts
+
+
+def get_seir_fits(data, processes=1, incubation=5.2, infectious=7.0):
+    """
+    Returns the SEIR parameters of all regions as a table, see compute_seir.
+    """
+    data = get_store(data)
+    seir = data.get_seir(incubation, infectious, processes)
+    fits = pd.DataFrame({"Region": data.regions})
+    for k in ["R0", "beta", "e0", "confirmed_scale", "deaths_scale", "rmse", "offset"]:
+        fits[k] = seir[k]
+    return fits
+
+
+def get_lag_table(data, max_lag=40, mortality=0.015, avg=7, level=None):
+    """
+    Returns the best lag between confirmed cases and deaths, its correlation
+    and the implied detected fraction of all regions of the given level as a
+    table, see compute_lag_correlation.
+    """
+    data = get_store(data)
+    lags = compute_lag_correlation(data, max_lag, mortality, avg)
+    table = pd.DataFrame(
+        {
+            "Region": data.regions,
+            "Lag": lags["lag"],
+            "Correlation": lags["max_correlation"],
+            "Detected Fraction": lags["detected_fraction"],
+        }
+    )
+    if level is not None:
+        table = table[table.Region.str.count(REGION_SEP) == level]
+    return table.reset_index(drop=True)
+
+
 def get_icu_limit(
     icus_per_capita: float, icu_rate: float = 0.06, duration_of_stay=None
 ):
@@ -241,9 +1693,526 @@ def get_icu_limit(
     return icu_limit
 
 
+# Parameter values evaluated by sweep_estimates, centered on the assumptions
+# of the plots
+SWEEP_GRID = {
+    "death_rate": [0.005, 0.0075, 0.01, 0.013, 0.015, 0.02, 0.03],
+    "growth_rate": [1.2, 1.25, 1.3, 1.33, 1.4],
+    "delay": [5, 6, 7, 8, 9],
+    "icu_rate": [0.03, 0.045, 0.06, 0.08, 0.1],
+    "icu_time": [10, 14, 18, 22, 26],
+    "mortality": [0.005, 0.01, 0.015, 0.02],
+    "offset": [7, 9, 11, 13, 15, 17, 19, 21],
+}
+
+
+def sweep_estimates(data, country_list, **grid):
+    """
+    Evaluates the estimators of the plots on the latest data of all countries
+    for every combination of their parameters. Each estimator is computed on
+    a parameters x countries array at once.
+
+    Input:
+        data            DataFrame or TimeSeriesStore
+        country_list    dict    country -> [inhabitants, ICUs per capita]
+        grid            lists of parameter values overriding SWEEP_GRID
+
+    Returns:
+        sweep   DataFrame   one row per estimator, parameter combination and
+                            country with the columns Region, Date, Estimator,
+                            the parameters (NaN if not used by the estimator)
+                            and Value:
+                            "Estimated from Deaths" cases per capita
+                                (death_rate)
+                            "Estimated from Delay" cases per capita
+                                (growth_rate, delay)
+                            "ICU Limit" new infections per capita and day
+                                (icu_rate, icu_time)
+                            "ICU Load" new infections relative to the ICU
+                                limit (icu_rate, icu_time)
+                            "Detected Fraction" of the cases estimated from
+                                the deaths offset days later (mortality,
+                                offset)
+    """
+    unknown = set(grid) - set(SWEEP_GRID)
+    if unknown:
+        raise ValueError("Unknown sweep parameters {}".format(sorted(unknown)))
+    grid = {**SWEEP_GRID, **grid}
+
+    store = get_store(data)
+    countries = [c for c in country_list if c in store.region_index]
+    regions = np.array([store.region_index[c] for c in countries], dtype=int)
+    nr_inhabitants = np.array([country_list[c][0] for c in countries])
+    icus_per_capita = np.array([country_list[c][1] for c in countries])
+
+    metrics = store.get_metrics()
+    dates, confirmed, lengths = metrics["Confirmed"]
+    _, deaths, _ = metrics["Deaths"]
+    _, new_infections, _ = metrics["New Infections"]
+    last = np.maximum(lengths[regions] - 1, 0)
+    # Countries without any report get NaN
+    empty = np.where(lengths[regions] > 0, 1.0, np.nan)
+    last_date = dates[last, regions]
+    last_confirmed = confirmed[last, regions] * empty
+    last_deaths = deaths[last, regions] * empty
+    last_new = new_infections[np.maximum(last - 1, 0), regions]
+    last_new = np.where(lengths[regions] > 1, last_new, np.nan)
+
+    def combinations(*names):
+        values = np.meshgrid(
+            *[np.asarray(grid[n], float) for n in names], indexing="ij"
+        )
+        return {n: v.ravel()[:, None] for n, v in zip(names, values)}
+
+    tables = []
+
+    def add(estimator, params, value, date=last_date):
+        value, date = np.broadcast_arrays(value, date)
+        table = pd.DataFrame(
+            {
+                "Region": np.tile(countries, len(value)),
+                "Date": pd.to_datetime(date.ravel()),
+                "Estimator": estimator,
+            }
+        )
+        for name in grid:
+            if name in params:
+                table[name] = np.repeat(params[name][:, 0], len(countries))
+            else:
+                table[name] = np.nan
+        table["Value"] = value.ravel()
+        tables.append(table)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = combinations("death_rate")
+        add(
+            "Estimated from Deaths",
+            p,
+            last_deaths / p["death_rate"] / nr_inhabitants,
+        )
+
+        p = combinations("growth_rate", "delay")
+        add(
+            "Estimated from Delay",
+            p,
+            last_confirmed / nr_inhabitants * p["growth_rate"] ** p["delay"],
+        )
+
+        p = combinations("icu_rate", "icu_time")
+        icu_limit = get_icu_limit(
+            icus_per_capita=icus_per_capita,
+            icu_rate=p["icu_rate"],
+            duration_of_stay=p["icu_time"],
+        )
+        add("ICU Limit", p, icu_limit)
+        add("ICU Load", p, last_new / nr_inhabitants / icu_limit)
+
+        # Like in plot_fraction_tested_from_deaths the fraction is dated to
+        # the confirmed cases, offset reports before the latest deaths
+        p = combinations("mortality", "offset")
+        offset = p["offset"].astype(int)
+        rows = last - offset
+        before = np.where(rows >= 0, 1.0, np.nan)
+        rows = np.maximum(rows, 0)
+        add(
+            "Detected Fraction",
+            p,
+            confirmed[rows, regions] * before * p["mortality"] / last_deaths,
+            dates[rows, regions],
+        )
+
+    return pd.concat(tables, ignore_index=True)
+
+
+# Inhabitants and ICU beds per capita
+# https://link.springer.com/article/10.1007/s00134-012-2627-8
+# https://link.springer.com/article/10.1007/s00134-015-4165-7
+# https://en.wikipedia.org/wiki/List_of_countries_by_hospital_beds#Numbers
+COUNTRY_LIST = {
+    "Germany": [82.79e6, 29.2 / 100000],
+    "US": [327.2e6, 34.2 / 100000],
+    "Italy": [60.48e6, 12.5 / 100000],
+    "France": [66.99e6, 11.6 / 100000],
+    "Spain": [46.66e6, 9.7 / 100000],
+    "UK": [66.44e6, 6.6 / 100000],
+    "Switzerland": [8.57e6, 11.0 / 100000],
+    "Austria": [8.822e6, 21.8 / 100000],
+    "Sweden": [10.12e6, 5.8/100000],
+    # "Denmark": [5.603e6, 6.7/100000],
+    # "Norway": [5.368e6, 8.0/100000],
+    "South Korea": [51.47e6, 10.6 / 100000],
+    "Japan": [126.8e6, 4.5 / 100000]
+    # "China": [1386e6, 3.6/100000],
+}
+
+
+def get_country_list(reserved_icus=3.5 / 100000):
+    """
+    Derive the COVID ICU capacities assuming a minimum of 3.5 ICUs per 100000
+    for regular hospital cases and all other ICUs available for corona
+    patients. This is an arbitrary number that seems somehow reasonable to me
+    given that some contries can maintain a good-ish health system with only
+    4.5 ICUs per 100000 (e.g. Japan, Portugal)
+
+    Returns:
+        country_list    dict    country -> [inhabitants, COVID ICUs per capita]
+    """
+    return {
+        c: [inhabitants, icus - reserved_icus]
+        for c, (inhabitants, icus) in COUNTRY_LIST.items()
+    }
+
+
+def load_populations(path=PATH_LOOKUP_TABLE):
+    """
+    Inhabitants of all countries, provinces and Admin2 regions from the CSSE
+    lookup table. The numbers of COUNTRY_LIST take precedence, they are also
+    the only ones if the table does not exist.
+
+    Returns:
+        populations     dict    region ID -> inhabitants
+    """
+    populations = {}
+    if isfile(path):
+        table = pd.read_csv(
+            path,
+            usecols=["Admin2", "Province_State", "Country_Region", "Population"],
+            dtype={"Admin2": str, "Province_State": str, "Country_Region": str},
+            encoding="utf-8-sig",
+        ).rename(columns=REPORT_COLUMNS)
+        table["Country/Region"] = table["Country/Region"].replace(COUNTRY_ALIASES)
+        table = table[table["Population"] > 0]
+        populations = dict(zip(get_region_ids(table), table["Population"]))
+    populations.update({c: inhabitants for c, (inhabitants, _) in COUNTRY_LIST.items()})
+    return populations
+
+
+class Leaderboard:
+    """
+    Ranks all regions of one level by metrics of their latest reports:
+        "Confirmed per Capita"          confirmed cases per inhabitant
+        "New Infections per Capita"     new cases per inhabitant and day over
+                                        the window
+        "Growth Rate"                   growth rate of ln(confirmed) per day,
+                                        fitted over the window
+        "ICU Pressure"                  new infections relative to the ICU
+                                        limit, see get_icu_limit, NaN for
+                                        countries without ICU data
+    Only the last window reports of every region are kept, so that new daily
+    reports get merged in place, see update, instead of rebuilding the
+    arrays of the whole data set.
+
+    Input:
+        data            DataFrame or TimeSeriesStore
+        populations     dict    region ID -> inhabitants, see load_populations
+        country_list    dict    country -> [inhabitants, ICUs per capita]
+        level           int     rank countries (0), provinces (1) or Admin2
+                                regions (2)
+        window          int     number of reports the new infections and the
+                                growth rate are based on
+        icu_rate        float   fraction of cases to require ICU treatment
+        icu_time        float   average number of days in an ICU
+    """
+
+    metrics = [
+        "Confirmed per Capita",
+        "New Infections per Capita",
+        "Growth Rate",
+        "ICU Pressure",
+    ]
+
+    def __init__(
+        self,
+        data,
+        populations,
+        country_list,
+        level=0,
+        window=7,
+        icu_rate=0.06,
+        icu_time=18,
+    ):
+        if window < 2:
+            raise ValueError("The leaderboard needs a window of at least 2 reports")
+        self.populations = populations
+        self.country_list = country_list
+        self.level = level
+        self.window = window
+        self.icu_rate = icu_rate
+        self.icu_time = icu_time
+        self.regions = []
+        self.region_index = {}
+        self.population = np.array([])
+        self.icu_limit = np.array([])
+        self.dates = np.empty((window, 0), dtype="datetime64[ns]")
+        self.confirmed = np.empty((window, 0))
+        self.values = {m: np.array([]) for m in self.metrics}
+
+        # The last window reports of every region, empty slots (NaT) first
+        store = get_store(data)
+        regions = store.get_regions(level)
+        self._add_regions(regions)
+        cols = np.array([store.region_index[r] for r in regions], dtype=int)
+        dates, confirmed, lengths = store.get_metrics()["Confirmed"]
+        rows = lengths[cols] - window + np.arange(window)[:, None]
+        kept = rows >= 0
+        rows = np.maximum(rows, 0)
+        self.dates[:] = np.where(kept, dates[rows, cols], np.datetime64("NaT"))
+        self.confirmed[:] = np.where(kept, confirmed[rows, cols], np.nan)
+        self._compute(np.arange(len(regions)))
+
+    def _add_regions(self, regions):
+        icu_limit = [
+            get_icu_limit(self.country_list[r][1], self.icu_rate, self.icu_time)
+            if r in self.country_list
+            else np.nan
+            for r in regions
+        ]
+        population = [self.populations.get(r, np.nan) for r in regions]
+        for r in regions:
+            self.region_index[r] = len(self.regions)
+            self.regions.append(r)
+        self.population = np.concatenate([self.population, population])
+        self.icu_limit = np.concatenate([self.icu_limit, icu_limit])
+        empty = (self.window, len(regions))
+        self.dates = np.hstack([self.dates, np.full(empty, np.datetime64("NaT"))])
+        self.confirmed = np.hstack([self.confirmed, np.full(empty, np.nan)])
+        for m in self.metrics:
+            self.values[m] = np.concatenate(
+                [self.values[m], np.full(len(regions), np.nan)]
+            )
+
+    def _compute(self, cols):
+        dates = self.dates[:, cols]
+        confirmed = self.confirmed[:, cols]
+        valid = ~np.isnat(dates)
+        days = (dates - dates[-1]) / np.timedelta64(1, "D")
+        first = np.argmax(valid, axis=0)
+        regions = np.arange(len(cols))
+
+        # Least-squares fit of ln(confirmed) over the dates of the reports
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logy = np.log(confirmed)
+        fitted = valid & np.isfinite(logy)
+        x = np.where(fitted, days, 0)
+        logy = np.where(fitted, logy, 0)
+        n = fitted.sum(axis=0)
+        sx = x.sum(axis=0)
+        sy = logy.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = (n * (x * logy).sum(axis=0) - sx * sy) / (
+                n * (x ** 2).sum(axis=0) - sx ** 2
+            )
+            new_infections = (confirmed[-1] - confirmed[first, regions]) / -days[
+                first, regions
+            ]
+        rate[n < 2] = np.nan
+        new_infections[first == len(dates) - 1] = np.nan
+
+        population = self.population[cols]
+        self.values["Confirmed per Capita"][cols] = confirmed[-1] / population
+        self.values["New Infections per Capita"][cols] = new_infections / population
+        self.values["Growth Rate"][cols] = rate
+        self.values["ICU Pressure"][cols] = (
+            new_infections / population / self.icu_limit[cols]
+        )
+
+    def update(self, reports):
+        """
+        Merges daily reports into the kept reports and recomputes the metrics
+        of the regions they contain. A report of a date that is already kept
+        replaces it, reports older than the window are ignored. Regions that
+        are not ranked yet get added.
+
+        Input:
+            reports     DataFrame   long-format data, e.g. a parsed daily
+                                    report or the rows of new dates
+
+        Returns:
+            regions     list    IDs of the updated regions
+        """
+        if "Region" not in reports:
+            reports = reports.assign(Region=get_region_ids(reports))
+        reports = reports[get_region_level(reports) == self.level]
+        # Duplicate rows of the same region and date are summed, like in
+        # TimeSeriesStore
+        reports = (
+            reports.groupby(["Date", "Region"], observed=True)["Confirmed"]
+            .sum()
+            .reset_index()
+        )
+        regions = [str(r) for r in pd.unique(reports["Region"])]
+        self._add_regions([r for r in regions if r not in self.region_index])
+
+        for date, report in reports.groupby("Date", sort=True):
+            cols = np.array([self.region_index[r] for r in report["Region"]], dtype=int)
+            confirmed = report["Confirmed"].to_numpy(dtype=float)
+            date = np.datetime64(pd.Timestamp(date), "ns")
+            dates = self.dates[:, cols]
+            values = self.confirmed[:, cols]
+
+            same = dates == date
+            values = np.where(same, confirmed, values)
+            # Other reports get appended and the oldest one dropped after
+            # sorting by date
+            new = ~same.any(axis=0)
+            dates = np.vstack([dates, np.where(new, date, np.datetime64("NaT"))])
+            values = np.vstack([values, np.where(new, confirmed, np.nan)])
+            order = np.argsort(dates.view("i8"), axis=0, kind="stable")[1:]
+            self.dates[:, cols] = np.take_along_axis(dates, order, axis=0)
+            self.confirmed[:, cols] = np.take_along_axis(values, order, axis=0)
+
+        self._compute(np.array([self.region_index[r] for r in regions], dtype=int))
+        return regions
+
+    def top(self, metric, n=10, ascending=False):
+        """
+        Returns the n regions with the highest (or lowest) value of a metric
+        as DataFrame with the columns Region, Date of the last report and all
+        metrics. Only the top n get sorted, the rest is split off by a partial
+        selection. Regions with NaN are left out.
+        """
+        if metric not in self.values:
+            raise ValueError("Unknown metric {}".format(metric))
+        values = self.values[metric]
+        candidates = np.flatnonzero(~np.isnan(values))
+        keys = values[candidates] if ascending else -values[candidates]
+        n = max(min(n, len(candidates)), 0)
+        if n < len(candidates):
+            selected = np.argpartition(keys, n)[:n]
+        else:
+            selected = np.arange(len(candidates))
+        selected = selected[np.argsort(keys[selected], kind="stable")]
+        cols = candidates[selected]
+        table = pd.DataFrame(
+            {
+                "Region": [self.regions[i] for i in cols],
+                "Date": pd.to_datetime(self.dates[-1, cols]),
+            }
+        )
+        for m in self.metrics:
+            table[m] = self.values[m][cols]
+        return table
+
+
+PLOT_FINGERPRINT_KEY = "kovid fingerprint"
+
+
+def get_plot_fname(country_list, name):
+    if len(country_list) == 1:
+        c = next(iter(country_list)).replace(REGION_SEP, "_")
+        return "{}_{}.png".format(c.replace(" ", "_").lower(), name)
+    return "countries_{}.png".format(name)
+
+
+# Functions the plots are computed with. Their source is part of every plot
+# fingerprint, so that a change to them renders the plots again.
+PLOT_HELPERS = [
+    "log_interp1d",
+    "log_extrapol",
+    "moving_average",
+    "TimeSeriesStore",
+    "compute_metrics",
+    "compute_log_trends",
+    "compute_lag_correlation",
+    "get_store",
+    "get_spread_rate_by_country",
+    "get_infection_rate_by_country",
+    "get_new_infections_by_country",
+    "get_confirmed_by_country",
+    "get_deaths_by_country",
+    "get_icu_limit",
+    "get_detected_fraction_lines",
+    "get_new_infections_lines",
+]
+_plot_helpers_hash = None
+
+
+def get_plot_helpers_hash():
+    # The sources do not change while running, so they are hashed only once
+    global _plot_helpers_hash
+    if _plot_helpers_hash is None:
+        sha1 = hashlib.sha1()
+        for name in PLOT_HELPERS:
+            sha1.update(inspect.getsource(globals()[name]).encode())
+        _plot_helpers_hash = sha1.hexdigest()
+    return _plot_helpers_hash
+
+
+def get_plot_fingerprint(data, country_list, plot_function, **params):
+    """
+    Hash of everything a plot depends on: the series of the plotted countries,
+    their population and ICU numbers, the plot parameters, the color cycle and
+    the source code of the plot function and of PLOT_HELPERS.
+    """
+    store = get_store(data)
+    sha1 = hashlib.sha1()
+    sha1.update(inspect.getsource(plot_function).encode())
+    sha1.update(get_plot_helpers_hash().encode())
+    sha1.update(repr(sorted(params.items())).encode())
+    sha1.update(repr(plt.rcParams["axes.prop_cycle"]).encode())
+    for c in country_list:
+        sha1.update(repr((c, country_list[c])).encode())
+        for column in ["Confirmed", "Deaths"]:
+            dates, values = store.get_series(c, column)
+            sha1.update(dates.tobytes())
+            sha1.update(values.tobytes())
+    return sha1.hexdigest()
+
+
+# Directory the plots of each thread are written to, see plot_directory
+_plot_output = threading.local()
+
+
+def get_plot_directory():
+    return getattr(_plot_output, "path", "png/")
+
+
+@contextmanager
+def plot_directory(path):
+    """
+    Writes the plots rendered by the current thread to path instead of png/,
+    e.g. so that the plots of server queries do not replace the published
+    ones.
+    """
+    previous = get_plot_directory()
+    _plot_output.path = join(path, "")
+    try:
+        yield
+    finally:
+        _plot_output.path = previous
+
+
+def is_plot_up_to_date(fname, fingerprint):
+    # The fingerprint is stored as text chunk in the PNG file, see save_plot
+    try:
+        with Image.open(get_plot_directory() + fname) as image:
+            return image.text.get(PLOT_FINGERPRINT_KEY) == fingerprint
+    except OSError:
+        # Missing, or truncated by an interrupted run (UnidentifiedImageError
+        # and the other errors of PIL are OSErrors, too)
+        return False
+
+
+def save_plot(fname, fingerprint):
+    plt.savefig(
+        get_plot_directory() + fname,
+        bbox_inches="tight",
+        metadata={PLOT_FINGERPRINT_KEY: fingerprint},
+    )
+    plt.close()
+
+
 def plot_spread_rate(
     data, country_list, avg=5, date_lim=None
 ):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "rate")
+    fingerprint = get_plot_fingerprint(
+        data, country_list, plot_spread_rate, avg=avg, date_lim=date_lim
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -267,19 +2236,22 @@ def plot_spread_rate(
     ax.tick_params(axis="x", rotation=60)
     ax.set_xlim(date_lim)
     ax.set_ylim([0, 100])
-    if len(country_list) == 1:
-        c = [x for x in country_list.keys()]
-        fname = "{}_rate.png".format(c[0].replace(" ", "_").lower())
-    else:
-        fname = "{}_rate.png".format("countries")
     ax.set_ylabel("daily spread rate (and its {} days average) [%]".format(avg))
     ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 def plot_infection_rate(
     data, country_list, avg=5, date_lim=None
 ):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "infection_rate")
+    fingerprint = get_plot_fingerprint(
+        data, country_list, plot_infection_rate, avg=avg, date_lim=date_lim
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -303,20 +2275,40 @@ def plot_infection_rate(
     ax.tick_params(axis="x", rotation=60)
     ax.set_xlim(date_lim)
     ax.set_ylim([0, 2])
-    if len(country_list) == 1:
-        c = [x for x in country_list.keys()]
-        fname = "{}_infection_rate.png".format(c[0].replace(" ", "_").lower())
-    else:
-        fname = "{}_infection_rate.png".format("countries")
     ax.set_ylabel("relative new infections (and {} days average) [%]".format(avg))
     ax.legend()
-    plt.savefig("png/"+fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 
 def plot_new_infected(
-    data, country_list, avg=5, date_lim=None, scale="log", forecast=21, ext_base=7
+    data,
+    country_list,
+    avg=5,
+    date_lim=None,
+    scale="log",
+    forecast=21,
+    ext_base=7,
+    icu_rate=0.06,
+    icu_time=18,
 ):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "new_infections")
+    fingerprint = get_plot_fingerprint(
+        data,
+        country_list,
+        plot_new_infected,
+        avg=avg,
+        date_lim=date_lim,
+        scale=scale,
+        forecast=forecast,
+        ext_base=ext_base,
+        icu_rate=icu_rate,
+        icu_time=icu_time,
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -327,9 +2319,10 @@ def plot_new_infected(
 
         nr_inhabitants = country_list[c][0]
 
-        icu_time = 18  # days
         icu_limit = 1e6*get_icu_limit(
-            icus_per_capita=country_list[c][1], duration_of_stay=icu_time
+            icus_per_capita=country_list[c][1],
+            icu_rate=icu_rate,
+            duration_of_stay=icu_time,
         )
         icu_limit_max = icu_limit if icu_limit > icu_limit_max else icu_limit_max
 
@@ -343,23 +2336,16 @@ def plot_new_infected(
         infected = 1e6*np.array(ts["New Infections"]) / nr_inhabitants
 
         # Extrapolate based on the last 7 days
-        _f = log_extrapol(np.arange(ext_base), infected[-ext_base:])
-        f = lambda d: _f(d.days)
-        # print(max(ts.Date) - pd.Timedelta(ext_base, unit="d"))
-        ext_range = pd.date_range(
-            max(ts.Date) - pd.Timedelta(ext_base, unit="d"),
-            max(ts.Date) + pd.Timedelta(forecast, unit="d"),
+        ext_range, extrapolated = data.get_forecast(
+            c, "New Infections", ext_base, forecast
         )
+        extrapolated = 1e6 * extrapolated / nr_inhabitants
 
         if len(country_list) == 1:
             pl, = ax.plot(ts.Date, infected, color="black", alpha=0.9, label=c)
         else:
             pl, = ax.plot(ts.Date, infected, alpha=0.9, label=c)
-        ax.plot(ext_range,
-                f(ext_range - max(ts.Date) + pd.Timedelta(ext_base-1, unit="d")),
-                "-",
-                color=pl.get_color(),
-                alpha=0.3)
+        ax.plot(ext_range, extrapolated, "-", color=pl.get_color(), alpha=0.3)
         ax.plot(date_lim, 2*[icu_limit], "--", color=pl.get_color(), alpha=0.5)
 
     ax.tick_params(axis="x", rotation=60)
@@ -371,23 +2357,35 @@ def plot_new_infected(
         ax.set_yscale("log")
     else:
         ax.set_ylim([0, 1.3 * icu_limit_max])
-    ax.yaxis.set_major_formatter(ScalarFormatter())
+    ax.yaxis.set_major_formatter(ticker.ScalarFormatter())
     if len(country_list) == 1:
-        ax.set_ylabel("new infections per 1,000,000 capita ({})".format(country_list[0]))
-        fname = "{}_new_infections.png".format(
-            country_list[0].replace(" ", "_").lower()
-        )
+        country = next(iter(country_list))
+        ax.set_ylabel("new infections per 1,000,000 capita ({})".format(country))
     else:
         ax.set_ylabel("new infections per 1,000,000 capita")
-        fname = "{}_new_infections.png".format("countries")
         ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 
 def plot_confirmed(
     data, country_list, avg=5, date_lim=None, scale="log", forecast=21, ext_base=7
 ):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "confirmed")
+    fingerprint = get_plot_fingerprint(
+        data,
+        country_list,
+        plot_confirmed,
+        avg=avg,
+        date_lim=date_lim,
+        scale=scale,
+        forecast=forecast,
+        ext_base=ext_base,
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -408,26 +2406,14 @@ def plot_confirmed(
         confirmed = 1e6*np.array(ts.Confirmed) / nr_inhabitants
 
         # Extrapolate based on the last 7 days
-        # _f = log_interp1d(np.arange(ext_base)[::ext_base-1], confirmed[-ext_base:][::ext_base-1])
-        _f = log_extrapol(np.arange(ext_base), confirmed[-ext_base:])
-        f = lambda d: _f(d.days)
-        # print(max(ts.Date) - pd.Timedelta(ext_base, unit="d"))
-        ext_range = pd.date_range(
-            max(ts.Date) - pd.Timedelta(ext_base, unit="d"),
-            max(ts.Date) + pd.Timedelta(forecast, unit="d"),
-        )
+        ext_range, extrapolated = data.get_forecast(c, "Confirmed", ext_base, forecast)
+        extrapolated = 1e6 * extrapolated / nr_inhabitants
 
         if len(country_list) == 1:
             pl, = ax.plot(ts.Date, confirmed, color="black", alpha=0.9, label=c)
         else:
             pl, = ax.plot(ts.Date, confirmed, alpha=0.9, label=c)
-        ax.plot(
-            ext_range,
-            f(ext_range - max(ts.Date) + pd.Timedelta(ext_base - 1, unit="d")),
-            "-",
-            color=pl.get_color(),
-            alpha=0.3,
-        )
+        ax.plot(ext_range, extrapolated, "-", color=pl.get_color(), alpha=0.3)
         ax.plot(date_lim, 2 * [icu_limit], "--", color=pl.get_color(), alpha=0.5)
 
     ax.tick_params(axis="x", rotation=60)
@@ -436,21 +2422,45 @@ def plot_confirmed(
     ax.grid(True)
     if scale == "log":
         ax.set_yscale("log")
-    ax.yaxis.set_major_formatter(ScalarFormatter())
+    ax.yaxis.set_major_formatter(ticker.ScalarFormatter())
     if len(country_list) == 1:
-        ax.set_ylabel("confirmed cases per 1,000,000 capita ({})".format(country_list[0]))
-        fname = "{}_confirmed.png".format(country_list[0].replace(" ", "_").lower())
+        country = next(iter(country_list))
+        ax.set_ylabel("confirmed cases per 1,000,000 capita ({})".format(country))
     else:
         ax.set_ylabel("confirmed cases per 1,000,000 capita")
-        fname = "{}_confirmed.png".format("countries")
         ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 
 def plot_estimated_from_delay(
-    data, country_list, avg=5, date_lim=None, scale="log", forecast=21, ext_base=7
+    data,
+    country_list,
+    avg=5,
+    date_lim=None,
+    scale="log",
+    forecast=21,
+    ext_base=7,
+    growth_rate=1.33,
+    delay=7,
 ):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "estimated_delay")
+    fingerprint = get_plot_fingerprint(
+        data,
+        country_list,
+        plot_estimated_from_delay,
+        avg=avg,
+        date_lim=date_lim,
+        scale=scale,
+        forecast=forecast,
+        ext_base=ext_base,
+        growth_rate=growth_rate,
+        delay=delay,
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -469,28 +2479,17 @@ def plot_estimated_from_delay(
         confirmed = np.array(ts.Confirmed)
 
         # 5 days incubation + 2 days test delay
-        estimated = confirmed / nr_inhabitants * 1.33 ** 7
+        estimated = confirmed / nr_inhabitants * growth_rate ** delay
 
         # Extrapolate based on the last 7 days
-        # _f = log_extrapol(np.arange(ext_base)[::ext_base-1], estimated[-ext_base:][::ext_base-1])
-        _f = log_extrapol(np.arange(ext_base), estimated[-ext_base:])
-        f = lambda d: _f(d.days)
-        ext_range = pd.date_range(
-            max(ts.Date) - pd.Timedelta(ext_base, unit="d"),
-            max(ts.Date) + pd.Timedelta(forecast, unit="d"),
-        )
+        ext_range, extrapolated = data.get_forecast(c, "Confirmed", ext_base, forecast)
+        extrapolated = extrapolated / nr_inhabitants * growth_rate ** delay
 
         if len(country_list) == 1:
             pl, = ax.plot(ts.Date, estimated, color="black", alpha=0.9, label=c)
         else:
             pl, = ax.plot(ts.Date, estimated, alpha=0.9, label=c)
-        ax.plot(
-            ext_range,
-            f(ext_range - max(ts.Date) + pd.Timedelta(ext_base - 1, unit="d")),
-            "-",
-            color=pl.get_color(),
-            alpha=0.3,
-        )
+        ax.plot(ext_range, extrapolated, "-", color=pl.get_color(), alpha=0.3)
         ax.plot(date_lim, 2 * [icu_limit], "--", color=pl.get_color(), alpha=0.5)
 
     ax.tick_params(axis="x", rotation=60)
@@ -500,23 +2499,43 @@ def plot_estimated_from_delay(
     if scale == "log":
         ax.set_yscale("log")
     if len(country_list) == 1:
+        country = next(iter(country_list))
         ax.set_ylabel(
-            "estimated cases per capita based on delay ({})".format(country_list[0])
-        )
-        fname = "{}_estimated_delay.png".format(
-            country_list[0].replace(" ", "_").lower()
+            "estimated cases per capita based on delay ({})".format(country)
         )
     else:
         ax.set_ylabel("estimated cases per capita based on delay")
-        fname = "{}_estimated_delay.png".format("countries")
         ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 
 def plot_estimated_from_deaths(
-    data, country_list, avg=5, date_lim=None, scale="log", forecast=21, ext_base=7
+    data,
+    country_list,
+    avg=5,
+    date_lim=None,
+    scale="log",
+    forecast=21,
+    ext_base=7,
+    death_rate=0.013,
 ):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "estimated_deaths")
+    fingerprint = get_plot_fingerprint(
+        data,
+        country_list,
+        plot_estimated_from_deaths,
+        avg=avg,
+        date_lim=date_lim,
+        scale=scale,
+        forecast=forecast,
+        ext_base=ext_base,
+        death_rate=death_rate,
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -534,30 +2553,17 @@ def plot_estimated_from_deaths(
         # Derive averaged time series
         deaths = 1e6*np.array(ts.Deaths)
 
-        # 5 days incubation + 2 days test delay
-        death_rate = 0.013
         estimated = deaths / death_rate / nr_inhabitants
 
         # Extrapolate based on the last 7 days
-        # _f = log_extrapol(np.arange(ext_base)[::ext_base-1], estimated[-ext_base:][::ext_base-1])
-        _f = log_extrapol(np.arange(ext_base), estimated[-ext_base:])
-        f = lambda d: _f(d.days)
-        ext_range = pd.date_range(
-            max(ts.Date) - pd.Timedelta(ext_base, unit="d"),
-            max(ts.Date) + pd.Timedelta(forecast, unit="d"),
-        )
+        ext_range, extrapolated = data.get_forecast(c, "Deaths", ext_base, forecast)
+        extrapolated = 1e6 * extrapolated / death_rate / nr_inhabitants
 
         if len(country_list) == 1:
             pl, = ax.plot(ts.Date, estimated, color="black", alpha=0.9, label=c)
         else:
             pl, = ax.plot(ts.Date, estimated, alpha=0.9, label=c)
-        ax.plot(
-            ext_range,
-            f(ext_range - max(ts.Date) + pd.Timedelta(ext_base - 1, unit="d")),
-            "-",
-            color=pl.get_color(),
-            alpha=0.3,
-        )
+        ax.plot(ext_range, extrapolated, "-", color=pl.get_color(), alpha=0.3)
         ax.plot(date_lim, 2 * [icu_limit], "--", color=pl.get_color(), alpha=0.5)
 
     ax.tick_params(axis="x", rotation=60)
@@ -566,29 +2572,34 @@ def plot_estimated_from_deaths(
     ax.grid(True)
     if scale == "log":
         ax.set_yscale("log")
-    ax.yaxis.set_major_formatter(ScalarFormatter())
+    ax.yaxis.set_major_formatter(ticker.ScalarFormatter())
     if len(country_list) == 1:
+        country = next(iter(country_list))
         ax.set_ylabel(
             "estimated cases per 1,000,000 capita based on {}% death rate ({})".format(
-                100 * death_rate, country_list[0]
+                100 * death_rate, country
             )
         )
-        fname = "{}_estimated_deaths.png".format(
-            country_list[0].replace(" ", "_").lower()
-        )
     else:
         ax.set_ylabel(
             "estimated cases per 1,000,000 capita based on {}% death rate".format(
                 100 * death_rate
             )
         )
-        fname = "{}_estimated_deaths.png".format("countries")
         ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 
 def plot_deathrate(data, country_list, avg=5, date_lim=None, scale="log"):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "deathrate")
+    fingerprint = get_plot_fingerprint(
+        data, country_list, plot_deathrate, avg=avg, date_lim=date_lim, scale=scale
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -608,12 +2619,10 @@ def plot_deathrate(data, country_list, avg=5, date_lim=None, scale="log"):
         if date_lim is None:
             date_lim = [np.min(ts.Date), np.max(ts.Date)]
 
-        # Derive averaged time series
-        deaths = np.array(ts.Deaths)
-        deaths_per_day = deaths[1:] - deaths[:-1]
-        # drop last day; arguably we should drop the first one, but this
-        # is consistent with the other functions
-        dates = np.array(ts.Date)[:-1]
+        # Deaths per day are dated to the first of the two days; arguably we
+        # should use the second one, but this is consistent with the other
+        # functions
+        dates, deaths_per_day = get_store(data).get_metric(c, "Deaths per Day")
 
         pl, = ax.plot(dates, deaths_per_day / nr_inhabitants, alpha=0.9, label=c)
         ax.plot(
@@ -626,17 +2635,24 @@ def plot_deathrate(data, country_list, avg=5, date_lim=None, scale="log"):
     if scale == "log":
         ax.set_yscale("log")
     if len(country_list) == 1:
-        ax.set_ylabel("deathrate per capita ({})".format(country_list[0]))
-        fname = "{}_deathrate.png".format(country_list[0].replace(" ", "_").lower())
+        country = next(iter(country_list))
+        ax.set_ylabel("deathrate per capita ({})".format(country))
     else:
         ax.set_ylabel("deathrate per capita")
-        fname = "countries_deathrate.png"
         ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
+    save_plot(fname, fingerprint)
+    return fname
 
 
 def plot_deaths(data, country_list, avg=5, date_lim=None, scale="log"):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "deaths")
+    fingerprint = get_plot_fingerprint(
+        data, country_list, plot_deaths, avg=avg, date_lim=date_lim, scale=scale
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
     fig = plt.figure(figsize=(8, 5))
     ax = fig.add_subplot()
 
@@ -665,47 +2681,43 @@ def plot_deaths(data, country_list, avg=5, date_lim=None, scale="log"):
     if scale == "log":
         ax.set_yscale("log")
     if len(country_list) == 1:
-        ax.set_ylabel("deaths per capita ({})".format(country_list[0]))
-        fname = "{}_deaths.png".format(country_list[0].replace(" ", "_").lower())
+        country = next(iter(country_list))
+        ax.set_ylabel("deaths per capita ({})".format(country))
     else:
         ax.set_ylabel("deaths per capita")
-        fname = "{}_deaths.png".format("countries")
         ax.legend()
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
-
+    save_plot(fname, fingerprint)
+    return fname
 
-def plot_fraction_tested_from_deaths(data, country_list, date_lim=None, mortality=0.015):
-    # we will be dividing by zero so suppress these warnings for this function
-    old_settings = np.seterr(divide="ignore")
-    fig = plt.figure(figsize=(8, 5))
-    ax = fig.add_subplot()
 
+def plot_fraction_tested_from_deaths(
+    data, country_list, date_lim=None, mortality=0.015, offsets=tuple(range(7, 23, 2))
+):
     if len(country_list) > 1:
         raise ValueError("The fraction_tested_from_deaths plot will be "
                          "unreadable for multiple countries.")
-    for c in country_list.keys():
-        ts_deaths = get_deaths_by_country(c, data)
-        ts_confirmed = get_confirmed_by_country(c, data)
-
-        nr_inhabitants = country_list[c][0]
-
-        # Derive averaged time series
-        deaths = np.array(ts_deaths.Deaths)
-        confirmed = np.array(ts_confirmed.Confirmed)
-        dates = np.array(ts_deaths.Date)
+    data = get_store(data)
+    c = next(iter(country_list))
+    fname = "{}_detected_fraction.png".format(c.replace(REGION_SEP, "_"))
+    fingerprint = get_plot_fingerprint(
+        data,
+        country_list,
+        plot_fraction_tested_from_deaths,
+        date_lim=date_lim,
+        mortality=mortality,
+        offsets=offsets,
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
 
-        offsets = [7 + 2 * i for i in range(8)]
-        # we need to assume a case-mortality-rate, guess it to be at 1%
-        infections_from_death = deaths / mortality
+    fig = plt.figure(figsize=(8, 5))
+    ax = fig.add_subplot()
 
-        for offset in offsets:
-            plot_dates = np.array(ts_deaths.Date[:-offset])
-            # avoiding division by zero warnings by using np.divide
-            plot_fraction = np.divide(
-                confirmed[:-offset], infections_from_death[offset:]
-            )
-            ax.plot(plot_dates, plot_fraction, label=f"{offset}")
+    for c in country_list.keys():
+        for dates, fraction, style in get_detected_fraction_lines(
+            data, c, mortality, offsets
+        ):
+            ax.plot(dates, fraction, **style)
 
     ax.axhline(1.0, color="black")
     ax.legend(title="Days till death")
@@ -715,123 +2727,1388 @@ def plot_fraction_tested_from_deaths(data, country_list, date_lim=None, mortalit
         ax.set_xlim(date_lim)
     ax.set_ylabel("Fraction of detected cases")
     ax.set_title(f"Country: {c}; start date limited by first death")
+    save_plot(fname, fingerprint)
+    return fname
+
+
+def plot_lag_correlation(data, country_list, max_lag=40, mortality=0.015, avg=7):
+    data = get_store(data)
+    fname = get_plot_fname(country_list, "lag_correlation")
+    fingerprint = get_plot_fingerprint(
+        data,
+        country_list,
+        plot_lag_correlation,
+        max_lag=max_lag,
+        mortality=mortality,
+        avg=avg,
+    )
+    if is_plot_up_to_date(fname, fingerprint):
+        return fname
+
+    fig = plt.figure(figsize=(8, 5))
+    ax = fig.add_subplot()
+
+    lags = compute_lag_correlation(data, max_lag, mortality, avg)
+    for c in country_list:
+        if c not in data.region_index:
+            continue
+        i = data.region_index[c]
+        label = "{} ({:.0f} days, {:.0%} detected)".format(
+            c, lags["lag"][i], lags["detected_fraction"][i]
+        )
+        pl, = ax.plot(lags["correlation"][:, i], alpha=0.9, label=label)
+        ax.plot(
+            lags["lag"][i], lags["max_correlation"][i], "o", color=pl.get_color()
+        )
+
+    ax.set_xlim([0, max_lag])
+    ax.set_xlabel("days from confirmed cases to deaths")
+    ax.set_ylabel("correlation of new cases and deaths ({} days average)".format(avg))
+    ax.grid(True)
+    ax.legend()
+    save_plot(fname, fingerprint)
+    return fname
+
+
+# Plot functions by the name used in their file names
+PLOT_FUNCTIONS = {
+    "rate": plot_spread_rate,
+    "infection_rate": plot_infection_rate,
+    "new_infections": plot_new_infected,
+    "confirmed": plot_confirmed,
+    "estimated_delay": plot_estimated_from_delay,
+    "estimated_deaths": plot_estimated_from_deaths,
+    "deathrate": plot_deathrate,
+    "deaths": plot_deaths,
+    "detected_fraction": plot_fraction_tested_from_deaths,
+    "lag_correlation": plot_lag_correlation,
+}
+
+
+# Data set shared with the plot workers, see render_plots
+_render_data = None
+
+
+def _init_render_worker(data, rc):
+    global _render_data
+    _render_data = data
+    plt.switch_backend("Agg")
+    plt.rcParams.update(rc)
+
+
+def _render_job(job):
+    plot_function, args, kwargs = job
+    return plot_function(_render_data, *args, **kwargs)
+
+
+def get_plot_jobs(data, country_list, forecast=14, ext_base=6):
+    """
+    The standard set of plots, see render_plots.
+
+    Input:
+        data            DataFrame or TimeSeriesStore
+        country_list    dict    country -> [inhabitants, ICUs per capita]
+        forecast        int     number of days to extrapolate
+        ext_base        int     number of days the extrapolation is based on
+
+    Returns:
+        jobs    list    (plot_function, args, kwargs) tuples
+    """
+    last_date = pd.Timestamp(get_store(data).dates.max())
+    date_lim = pd.to_datetime(
+        [
+            pd.Timestamp("2020-02-15"),
+            last_date + pd.Timedelta(forecast, unit="d"),
+        ]
+    )
+
+    # Cases
+    jobs = [
+        (
+            plot_new_infected,
+            (country_list,),
+            dict(
+                avg=5,
+                date_lim=date_lim,
+                forecast=forecast,
+                ext_base=ext_base,
+                scale="log",
+            ),
+        ),
+        (
+            plot_confirmed,
+            (country_list,),
+            dict(
+                avg=5,
+                date_lim=date_lim,
+                forecast=forecast,
+                ext_base=ext_base,
+            ),
+        ),
+        (
+            plot_estimated_from_deaths,
+            (country_list,),
+            dict(
+                avg=5,
+                date_lim=date_lim,
+                forecast=forecast,
+                ext_base=ext_base,
+            ),
+        ),
+        # (plot_estimated_from_delay, (country_list,), dict(avg=5, date_lim=date_lim, forecast=forecast, ext_base=ext_base)),
+        # (plot_deaths, (country_list,), dict(avg=5, date_lim=date_lim)),
+        (plot_deathrate, (country_list,), dict(avg=5, date_lim=date_lim)),
+    ]
+    for c in ["Germany", "US", "UK", "Italy", "Switzerland", "South Korea"]:
+        jobs.append(
+            (plot_fraction_tested_from_deaths, ({c: country_list[c]},), {})
+        )
+
+    # Rates
+    date_lim = pd.to_datetime([pd.Timestamp("2020-02-15"), last_date])
+    country_list_rates = {
+        c: country_list[c] for c in ["Germany", "US", "South Korea", "Italy"]
+    }
+    jobs.append(
+        (plot_spread_rate, (country_list_rates,), dict(avg=3, date_lim=date_lim))
+    )
+
+    date_lim = pd.to_datetime([pd.Timestamp("2020-03-01"), last_date])
+    jobs.append(
+        (plot_infection_rate, (country_list_rates,), dict(avg=5, date_lim=date_lim))
+    )
+
+    return jobs
+
+
+def render_plots(data, jobs, processes=1):
+    """
+    Render independent plots, optionally in a pool of worker processes using
+    the headless Agg backend. Each worker receives data and the current
+    matplotlib settings (style, palette) once. Where available, the workers
+    are forked, so data is shared instead of pickled.
+
+    Input:
+        data        DataFrame or TimeSeriesStore passed to every plot function
+        jobs        list of (plot_function, args, kwargs) tuples
+        processes   int     number of worker processes
+
+    Returns:
+        fnames      list    file names of the plots in png/
+    """
+    if processes <= 1:
+        return [
+            plot_function(data, *args, **kwargs)
+            for plot_function, args, kwargs in jobs
+        ]
+
+    rc = {k: v for k, v in plt.rcParams.items() if k != "backend"}
+    mp_context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(jobs)),
+        mp_context=mp_context,
+        initializer=_init_render_worker,
+        initargs=(data, rc),
+    ) as executor:
+        # Consume the results to raise exceptions of the workers
+        return list(executor.map(_render_job, jobs))
+
+
+def get_detected_fraction_lines(
+    data, region, mortality=0.015, offsets=tuple(range(7, 23, 2))
+):
+    """
+    Lines of plot_fraction_tested_from_deaths: the confirmed cases divided by
+    the cases estimated from the deaths offset reports later, for every
+    offset.
+
+    Returns:
+        lines   list    (dates, values, style) of every line
+    """
+    store = get_store(data)
+    dates, deaths = store.get_series(region, "Deaths")
+    _, confirmed = store.get_series(region, "Confirmed")
+    # we need to assume a case-mortality-rate
+    infections_from_death = deaths / mortality
+    lines = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for offset in offsets:
+            lines.append(
+                (
+                    dates[:-offset],
+                    confirmed[:-offset] / infections_from_death[offset:],
+                    dict(label=f"{offset}"),
+                )
+            )
+    return lines
+
+
+def get_new_infections_lines(data, region, avg=5, forecast=21, ext_base=7):
+    """
+    Lines of the new infections of a region, their moving average and the
+    log-linear forecast of them.
+
+    Returns:
+        lines   list    (dates, values, style) of every line
+    """
+    store = get_store(data)
+    dates, new_infections = store.get_metric(region, "New Infections")
+    lines = [
+        (dates, new_infections, dict(color="C0", alpha=0.3)),
+        (
+            dates,
+            moving_average(new_infections, avg),
+            dict(color="C0", alpha=0.9, label="{} days average".format(avg)),
+        ),
+    ]
+    if len(dates):
+        ext_range, extrapolated = store.get_forecast(
+            region, "New Infections", ext_base, forecast
+        )
+        ext_range = np.asarray(ext_range, dtype="datetime64[ns]")
+    else:
+        ext_range, extrapolated = dates, new_infections
+    style = dict(color="C0", linestyle="--", alpha=0.5, label="forecast")
+    lines.append((ext_range, extrapolated, style))
+    return lines
+
+
+# Panels of SmallMultiples: the lines of a region and the fixed axes setup
+PANELS = {
+    "detected_fraction": dict(
+        lines=get_detected_fraction_lines,
+        ylabel="Fraction of detected cases",
+        ylim=[0, 1.5],
+        yscale="linear",
+        legend="Days till death",
+    ),
+    "new_infections": dict(
+        lines=get_new_infections_lines,
+        ylabel="new infections",
+        ylim=None,
+        yscale="log",
+        legend=None,
+    ),
+}
+
+
+class SmallMultiples:
+    """
+    Renders one panel per region while reusing a single figure with its axes
+    and line artists. Between regions only the line data (set_data), the
+    title and the y limits change. The figure, axes and legend are created
+    once, and the layout and the date ticks, which are the same for all
+    regions, are frozen after the first page. With a grid of rows x cols, the
+    panels of that many regions share one canvas and every page of the grid
+    is one file.
+
+    Input:
+        panel       str     name of the panel, see PANELS
+        rows        int     panels per column of a page
+        cols        int     panels per row of a page
+        panel_size  tuple   width and height of a panel in inches
+        params              parameters of the lines function of the panel
+    """
+
+    def __init__(self, panel, rows=1, cols=1, panel_size=(8, 5), **params):
+        self.name = panel
+        self.panel = PANELS[panel]
+        # With the defaults, so that the fingerprints and the date range are
+        # complete
+        signature = inspect.signature(self.panel["lines"])
+        self.params = {
+            name: p.default for name, p in list(signature.parameters.items())[2:]
+        }
+        self.params.update(params)
+        self.rows = rows
+        self.cols = cols
+        self.fig, axes = plt.subplots(
+            rows,
+            cols,
+            figsize=(cols * panel_size[0], rows * panel_size[1]),
+            squeeze=False,
+            layout="constrained",
+        )
+        self.axes = list(axes.ravel())
+        self.lines = [None] * len(self.axes)
+        self.frozen = False
+
+    def close(self):
+        plt.close(self.fig)
+
+    def get_fname(self, regions, page):
+        if len(self.axes) == 1:
+            return "panels/" + get_plot_fname(regions, self.name)
+        return "panels/{}_{}x{}_{:04d}.png".format(
+            self.name, self.rows, self.cols, page
+        )
+
+    def freeze(self):
+        # Keep the positions and the date ticks of the last drawn page
+        self.fig.set_layout_engine("none")
+        for ax in self.axes:
+            labels = [label.get_text() for label in ax.get_xticklabels()]
+            ax.xaxis.set_major_locator(ticker.FixedLocator(ax.get_xticks()))
+            ax.xaxis.set_major_formatter(ticker.FixedFormatter(labels))
+        self.frozen = True
+
+    def draw(self, i, data, region):
+        """
+        Draws the panel of a region into the i-th axes.
+        """
+        ax = self.axes[i]
+        store = get_store(data)
+        lines = self.panel["lines"](store, region, **self.params)
+        if self.lines[i] is None:
+            # All panels share the date range of the data and the forecast
+            ax.xaxis_date()
+            forecast = pd.Timedelta(self.params.get("forecast", 0), unit="d")
+            ax.set_xlim(store.dates.min(), store.dates.max() + forecast)
+            self.lines[i] = [ax.plot(x, y, **style)[0] for x, y, style in lines]
+            ax.set_yscale(self.panel["yscale"])
+            if self.panel["ylim"] is not None:
+                ax.set_ylim(self.panel["ylim"])
+            ax.set_ylabel(self.panel["ylabel"])
+            ax.tick_params(axis="x", rotation=60)
+            ax.grid(True)
+            if any("label" in style for _, _, style in lines):
+                ax.legend(title=self.panel["legend"])
+        else:
+            for line, (x, y, _) in zip(self.lines[i], lines):
+                line.set_data(x, y)
+        ax.set_title(region)
+        ax.set_visible(True)
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+
+    def render(self, data, regions, first_page=1):
+        """
+        Renders the panels of regions to png/panels/, skipping pages that are
+        up to date, see get_plot_fingerprint.
+
+        Input:
+            data        DataFrame or TimeSeriesStore
+            regions     list    country names or region IDs
+            first_page  int     number of the first page of a grid
+
+        Returns:
+            fnames      list    file names of the pages in png/
+        """
+        store = get_store(data)
+        makedirs(get_plot_directory() + "panels", exist_ok=True)
+        per_page = len(self.axes)
+        fnames = []
+        for page, start in enumerate(range(0, len(regions), per_page), first_page):
+            page_regions = {r: None for r in regions[start : start + per_page]}
+            fname = self.get_fname(page_regions, page)
+            fingerprint = get_plot_fingerprint(
+                store,
+                page_regions,
+                self.panel["lines"],
+                rows=self.rows,
+                cols=self.cols,
+                **self.params,
+            )
+            fnames.append(fname)
+            if is_plot_up_to_date(fname, fingerprint):
+                continue
+            for i, ax in enumerate(self.axes):
+                if i < len(page_regions):
+                    self.draw(i, store, list(page_regions)[i])
+                else:
+                    ax.set_visible(False)
+            self.fig.savefig(
+                get_plot_directory() + fname,
+                metadata={PLOT_FINGERPRINT_KEY: fingerprint},
+            )
+            if not self.frozen and all(lines is not None for lines in self.lines):
+                self.freeze()
+        return fnames
+
+
+def plot_small_multiples(data, regions, panel, rows=1, cols=1, first_page=1, **params):
+    """
+    Renders the panels of regions with one SmallMultiples, see there. Returns
+    the file names of the pages.
+    """
+    small_multiples = SmallMultiples(panel, rows, cols, **params)
+    try:
+        return small_multiples.render(data, regions, first_page)
+    finally:
+        small_multiples.close()
+
+
+def render_small_multiples(
+    data, regions, panel, rows=1, cols=1, processes=1, chunk_pages=50, **params
+):
+    """
+    Renders the panels of many regions, split into chunks of whole pages that
+    are rendered in worker processes, see render_plots. Each chunk reuses one
+    figure for all of its pages.
+
+    Input:
+        data        DataFrame or TimeSeriesStore
+        regions     list    country names or region IDs
+        panel       str     name of the panel, see PANELS
+        rows, cols  int     grid of panels per page
+        processes   int     number of worker processes
+        chunk_pages int     number of pages per chunk
+        params              parameters of the lines function of the panel
+
+    Returns:
+        fnames      list    file names of the pages in png/
+    """
+    per_chunk = rows * cols * chunk_pages
+    jobs = [
+        (
+            plot_small_multiples,
+            (regions[start : start + per_chunk], panel, rows, cols),
+            dict(first_page=start // (rows * cols) + 1, **params),
+        )
+        for start in range(0, len(regions), per_chunk)
+    ]
+    chunks = render_plots(data, jobs, processes=processes)
+    return [fname for fnames in chunks for fname in fnames]
+
+
+def write_gif(path, frames, fps):
+    # Pillow takes the frames after the first one from an iterator
+    frames = (Image.fromarray(frame).convert("RGB") for frame in frames)
+    first = next(frames)
+    first.save(
+        path, save_all=True, append_images=frames, duration=1000 / fps, loop=0
+    )
+
+
+def write_mp4(path, frames, fps, size):
+    # The RGBA frames are piped to ffmpeg as raw video
+    command = [
+        plt.rcParams["animation.ffmpeg_path"],
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgba",
+        "-s",
+        "{}x{}".format(*size),
+        "-r",
+        str(fps),
+        "-i",
+        "-",
+        "-vf",
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-vcodec",
+        "libx264",
+        "-pix_fmt",
+        "yuv420p",
+        path,
+    ]
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    except FileNotFoundError:
+        raise ValueError("Writing MP4 needs ffmpeg, write a GIF instead")
+    with process:
+        for frame in frames:
+            process.stdin.write(frame.tobytes())
+        process.stdin.close()
+    if process.returncode:
+        raise RuntimeError("ffmpeg failed writing {}".format(path))
+
+
+def animate_forecasts(
+    data,
+    country_list,
+    fname="countries_forecast.gif",
+    date_lim=None,
+    forecast=21,
+    ext_base=7,
+    icu_rate=0.06,
+    icu_time=18,
+    fps=5,
+):
+    """
+    Time-lapse of the curves of plot_confirmed and plot_new_infected: every
+    frame shows the data and the log-linear forecast as they stood on one
+    date. The forecasts of all dates come from one pass of
+    compute_rolling_log_trends. Axes, ICU limits and legends are drawn once,
+    each frame only redraws the curves and the date onto the saved
+    background (blitting).
+
+    Input:
+        data            DataFrame or TimeSeriesStore
+        country_list    dict    country -> [inhabitants, ICUs per capita]
+        fname           str     file name in png/, .gif or .mp4 (needs
+                                ffmpeg)
+        date_lim        list    first and last date of the x axes, the frames
+                                start at the first date
+        forecast        int     number of days to extrapolate
+        ext_base        int     number of days the extrapolation is based on
+        fps             float   frames per second
+
+    Returns:
+        fname           str     file name in png/
+    """
+    store = get_store(data)
+    ext = fname.rsplit(".", 1)[-1].lower()
+    if ext not in ("gif", "mp4"):
+        raise ValueError("Unknown animation format {}".format(fname))
+    if date_lim is None:
+        date_lim = [
+            store.dates.min(),
+            store.dates.max() + pd.Timedelta(forecast, unit="d"),
+        ]
+    frame_dates = np.asarray(store.dates[store.dates >= date_lim[0]])
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    panels = [
+        (axes[0], "Confirmed", "confirmed cases", [1e0, 1e4], None),
+        (axes[1], "New Infections", "new infections", [1e0, 1e3], icu_time),
+    ]
+    xx = np.arange(-1, ext_base + forecast)
+    curves = []
+    for ax, metric, name, ylim, duration_of_stay in panels:
+        dates, values, lengths = store.get_metrics()[metric]
+        trends = compute_rolling_log_trends((dates, values, lengths), ext_base)
+        ax.xaxis_date()
+        for c in country_list:
+            if c not in store.region_index:
+                continue
+            i = store.region_index[c]
+            scale = 1e6 / country_list[c][0]
+            c_dates = dates[: lengths[i], i]
+            c_values = scale * values[: lengths[i], i]
+
+            # Number of reports up to each frame and the forecast as of then
+            counts = np.searchsorted(c_dates, frame_dates, side="right")
+            if lengths[i]:
+                last = np.maximum(counts - 1, 0)
+                slope = trends["slope"][last, i][:, None]
+                intercept = trends["intercept"][last, i][:, None]
+                ext_values = scale * 10 ** (slope * xx + intercept)
+                ext_values[counts == 0] = np.nan
+                ends = c_dates[last]
+            else:
+                # No values, e.g. the new infections of a single report, the
+                # curves stay empty like in the static plots
+                ext_values = np.full((len(frame_dates), len(xx)), np.nan)
+                ends = frame_dates
+            ext_dates = ends[:, None] + (
+                np.arange(len(xx)) - ext_base
+            ) * np.timedelta64(1, "D")
+
+            if len(country_list) == 1:
+                pl, = ax.plot([], [], color="black", alpha=0.9, label=c)
+            else:
+                pl, = ax.plot([], [], alpha=0.9, label=c)
+            ext_line, = ax.plot([], [], "-", color=pl.get_color(), alpha=0.3)
+            icu_limit = 1e6 * get_icu_limit(
+                icus_per_capita=country_list[c][1],
+                icu_rate=icu_rate,
+                duration_of_stay=duration_of_stay,
+            )
+            ax.plot(date_lim, 2 * [icu_limit], "--", color=pl.get_color(), alpha=0.5)
+            curves.append(
+                (pl, ext_line, c_dates, c_values, counts, ext_dates, ext_values)
+            )
+
+        ax.tick_params(axis="x", rotation=60)
+        ax.set_xlim(date_lim)
+        ax.set_ylim(ylim)
+        ax.grid(True)
+        ax.set_yscale("log")
+        ax.yaxis.set_major_formatter(ticker.ScalarFormatter())
+        ax.set_ylabel("{} per 1,000,000 capita".format(name))
+        ax.legend(loc="lower right")
+    date_text = axes[0].text(0.02, 0.95, "", transform=axes[0].transAxes)
+
+    animated = [date_text]
+    for pl, ext_line, *_ in curves:
+        animated += [pl, ext_line]
+    for artist in animated:
+        artist.set_animated(True)
+    fig.tight_layout()
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+
+    def frames():
+        for f, date in enumerate(frame_dates):
+            canvas.restore_region(background)
+            for curve in curves:
+                pl, ext_line, c_dates, c_values, counts, ext_dates, ext_values = curve
+                pl.set_data(c_dates[: counts[f]], c_values[: counts[f]])
+                ext_line.set_data(ext_dates[f], ext_values[f])
+            date_text.set_text(pd.Timestamp(date).strftime("%Y-%m-%d"))
+            for artist in animated:
+                fig.draw_artist(artist)
+            yield np.asarray(canvas.buffer_rgba())
+
+    try:
+        if ext == "gif":
+            write_gif(get_plot_directory() + fname, frames(), fps)
+        else:
+            write_mp4(
+                get_plot_directory() + fname, frames(), fps, canvas.get_width_height()
+            )
+    finally:
+        plt.close(fig)
+    return fname
+
+
+class Dataset:
+    """
+    A loaded data set for programmatic use: series and derived metrics of
+    countries and regions, forecasts, ICU limits, estimates and plots. The
+    date x region arrays get built on first use and are shared by all
+    queries. matplotlib, seaborn and scipy are only imported once a plot or an
+    estimate needs them.
+
+    Input:
+        data            DataFrame   long-format data as returned by load_data
+        country_list    dict        country -> [inhabitants, ICUs per capita],
+                                    defaults to get_country_list()
+        populations     dict        region ID -> inhabitants for the
+                                    leaderboards, defaults to
+                                    load_populations()
+    """
+
+    def __init__(self, data, country_list=None, populations=None):
+        if country_list is None:
+            country_list = get_country_list()
+        self.data = data
+        self.country_list = country_list
+        self._store = None
+        self._populations = populations
+        self._leaderboards = {}
+
+    @classmethod
+    def load(cls, path=PATH_DATA, country_list=None):
+        return cls(load_data(path), country_list)
+
+    @classmethod
+    def from_daily_reports(
+        cls,
+        path_name=PATH_DAILY_REPORTS,
+        no_provinces=True,
+        processes=1,
+        country_list=None,
+    ):
+        data = get_data(path_name, no_provinces=no_provinces, processes=processes)
+        return cls(normalize_data(data), country_list)
+
+    @classmethod
+    def from_time_series(
+        cls, path_name=PATH_TIME_SERIES, no_provinces=True, country_list=None
+    ):
+        data = get_data_from_time_series(path_name, no_provinces=no_provinces)
+        return cls(normalize_data(data), country_list)
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = TimeSeriesStore(self.data)
+        return self._store
+
+    @property
+    def last_date(self):
+        return pd.Timestamp(self.store.dates.max())
+
+    @property
+    def populations(self):
+        if self._populations is None:
+            self._populations = load_populations()
+        return self._populations
+
+    def update(self, data, dates):
+        """
+        Returns a Dataset of data, which differs from this one only by the
+        reports of dates, see refresh_data. The store is extended by these
+        reports and the leaderboards are updated in place instead of being
+        rebuilt, unless reports got removed.
+        """
+        dataset = Dataset(data, self.country_list, self._populations)
+        reports = data[data.Date.isin(dates)]
+        if self._store is not None:
+            dataset._store = self._store.update(reports, dates)
+        if reports.Date.nunique() == len(set(dates)):
+            for leaderboard in self._leaderboards.values():
+                leaderboard.update(reports)
+            dataset._leaderboards = self._leaderboards
+        return dataset
+
+    def save(self, path=PATH_DATA):
+        save_data(self.data, path)
+
+    def regions(self, level=None):
+        return self.store.get_regions(level)
+
+    def series(self, region, column="Confirmed"):
+        """
+        Returns a DataFrame with the column and the Date of every report of a
+        country or region ID.
+        """
+        dates, values = self.store.get_series(region, column)
+        return pd.DataFrame({column: values, "Date": pd.to_datetime(dates)})
+
+    def metric(self, region, metric):
+        """
+        Returns a DataFrame with a derived series, see compute_metrics, and
+        its Date for a country or region ID.
+        """
+        dates, values = self.store.get_metric(region, metric)
+        return pd.DataFrame({metric: values, "Date": pd.to_datetime(dates)})
+
+    def forecast(self, region, metric="Confirmed", ext_base=7, forecast=21):
+        """
+        Returns a DataFrame with the log-linear extrapolation of a metric and
+        its Date for a country or region ID, see TimeSeriesStore.get_forecast.
+        """
+        dates, values = self.store.get_forecast(region, metric, ext_base, forecast)
+        return pd.DataFrame({metric: values, "Date": dates})
+
+    def growth_rate(self, region, window=7, metric="Confirmed"):
+        return get_growth_rate_by_country(region, self.store, window, metric)
+
+    def icu_limit(self, country, icu_rate=0.06, duration_of_stay=None):
+        return get_icu_limit(
+            icus_per_capita=self.country_list[country][1],
+            icu_rate=icu_rate,
+            duration_of_stay=duration_of_stay,
+        )
+
+    def sweep(self, **grid):
+        return sweep_estimates(self.store, self.country_list, **grid)
+
+    def leaderboard(self, level=0):
+        # Built on first use, afterwards only updated, see update
+        if level not in self._leaderboards:
+            self._leaderboards[level] = Leaderboard(
+                self.store, self.populations, self.country_list, level=level
+            )
+        return self._leaderboards[level]
+
+    def top(self, metric, n=10, level=0, ascending=False):
+        """
+        Returns the n regions of a level ranking highest by a metric, see
+        Leaderboard.
+        """
+        return self.leaderboard(level).top(metric, n, ascending)
+
+    def render(self, jobs=None, processes=1):
+        """
+        Renders the plots to png/, by default the standard set of
+        get_plot_jobs.
+
+        Input:
+            jobs        list    (plot_function, args, kwargs) tuples
+            processes   int     number of worker processes
+
+        Returns:
+            paths       list    paths of the rendered plots
+        """
+        if jobs is None:
+            jobs = get_plot_jobs(self.store, self.country_list)
+        self._set_plot_style()
+        fnames = render_plots(self.store, jobs, processes=processes)
+        return [get_plot_directory() + fname for fname in fnames]
+
+    def _set_plot_style(self):
+        sbn.set_style("whitegrid")
+        sbn.set_palette(
+            sbn.color_palette(
+                palette="colorblind", n_colors=len(self.country_list), desat=1
+            )
+        )
+        # The plots are only saved, never shown
+        plt.switch_backend("Agg")
+
+    def plot(self, plot_function, countries=None, **kwargs):
+        """
+        Renders a single plot of the given countries, by default of all
+        countries in the country list, and returns its path.
+        """
+        if countries is None:
+            countries = self.country_list
+        country_list = {c: self.country_list[c] for c in countries}
+        return self.render([(plot_function, (country_list,), kwargs)])[0]
+
+    def animate(self, fname="countries_forecast.gif", countries=None, **kwargs):
+        """
+        Renders the time-lapse of the countries, by default of all countries
+        in the country list, see animate_forecasts, and returns its path.
+        """
+        if countries is None:
+            countries = self.country_list
+        country_list = {c: self.country_list[c] for c in countries}
+        self._set_plot_style()
+        fname = animate_forecasts(self.store, country_list, fname, **kwargs)
+        return get_plot_directory() + fname
+
+    def panels(self, panel, regions=None, rows=1, cols=1, processes=1, **params):
+        """
+        Renders a panel per region, by default of all countries, see
+        render_small_multiples, and returns the paths of the pages.
+        """
+        if regions is None:
+            regions = self.regions(level=0)
+        plt.switch_backend("Agg")
+        fnames = render_small_multiples(
+            self.store, regions, panel, rows, cols, processes=processes, **params
+        )
+        return [get_plot_directory() + fname for fname in fnames]
+
+
+def print_top(dataset, n=10):
+    # The top n countries of every leaderboard metric
+    for metric in Leaderboard.metrics:
+        print("Top {} by {}".format(n, metric))
+        print(dataset.top(metric, n).to_string(index=False))
+
+
+def watch(
+    dataset,
+    manifest,
+    interval=10,
+    debounce=10,
+    plot=True,
+    no_provinces=True,
+    processes=1,
+    stopped=None,
+    top=0,
+):
+    """
+    Watch mode: ingests new daily reports as they arrive, see watch_reports,
+    and renders the plots again. The derived metrics get computed for the new
+    data, but only the plots whose input data changed get rendered, the others
+    are skipped by their fingerprint.
+
+    Input:
+        dataset     Dataset     current data
+        manifest    dict        manifest of the current data
+        interval    float       seconds between two checks of the reports
+        debounce    float       seconds without changes before ingesting
+        plot        bool        render the plots after each update
+        top         int         print the top countries of every metric
+                                after each update, see print_top
+    """
+
+    def refresh():
+        nonlocal dataset, manifest
+        data, manifest, dates = refresh_data(
+            PATH_DAILY_REPORTS,
+            dataset.data,
+            manifest,
+            no_provinces=no_provinces,
+            processes=processes,
+        )
+        if data is None:
+            return
+        dataset = dataset.update(data, dates)
+        print("Last data is from {}".format(dataset.last_date))
+        if plot:
+            dataset.render(processes=processes)
+        if top:
+            print_top(dataset, top)
+
+    watch_reports(PATH_DAILY_REPORTS, refresh, interval, debounce, stopped)
+
+
+def frame_to_json(ts):
+    # NaN and inf are not valid JSON
+    result = {}
+    for col in ts.columns:
+        if col == "Date":
+            result[col] = [d.strftime("%Y-%m-%d") for d in ts[col]]
+        elif col == "Region":
+            result[col] = list(ts[col])
+        else:
+            result[col] = [
+                v if math.isfinite(v) else None for v in ts[col].astype(float)
+            ]
+    return result
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    Local HTTP server answering queries from a dataset that is loaded once
+    and kept in memory. Requests are handled in threads. Results are cached
+    until the data changes, and plots are rendered one at a time, since
+    pyplot is not thread-safe.
+
+    Endpoints (GET, the answer is JSON unless noted):
+        /regions            level
+        /series             region, column
+        /metric             region, metric
+        /growth             region, window, metric
+        /forecast           region, metric, ext_base, forecast
+        /icu_limit          country, icu_rate, duration_of_stay
+        /top                metric, n, level, ascending
+        /plot/<name>.png    countries (comma separated), scale; PNG, see
+                            PLOT_FUNCTIONS for the names
+
+    Input:
+        address             tuple       (host, port)
+        dataset             Dataset
+        manifest            dict        manifest of the dataset, see
+                                        get_changed_reports
+        reload_interval     float       seconds between checks for new or
+                                        changed daily reports. They get
+                                        ingested like with --data
+                                        --incremental. If None, the data is
+                                        never reloaded.
+        debounce            float       seconds without changes of the
+                                        reports before reloading, see
+                                        watch_reports
+        cache_size          int         maximum number of cached results
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        dataset,
+        manifest=None,
+        reload_interval=None,
+        debounce=10,
+        cache_size=1024,
+        path_name=PATH_DAILY_REPORTS,
+        no_provinces=True,
+        processes=1,
+    ):
+        super().__init__(address, QueryHandler)
+        # Build the arrays before the first request
+        dataset.store.get_metrics()
+        # Dataset and generation get swapped together on reload, the
+        # generation is part of every cache key
+        self.state = (dataset, 0)
+        self.manifest = manifest if manifest is not None else {}
+        self.path_name = path_name
+        self.no_provinces = no_provinces
+        self.processes = processes
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+        self.plot_lock = threading.Lock()
+        # Plots of queries never replace the published ones in png/
+        self.plot_dir = tempfile.TemporaryDirectory()
+        self.stopped = threading.Event()
+        if reload_interval:
+            threading.Thread(
+                target=watch_reports,
+                args=(path_name, self.reload, reload_interval, debounce, self.stopped),
+                daemon=True,
+            ).start()
+
+    def server_close(self):
+        self.stopped.set()
+        super().server_close()
+        self.plot_dir.cleanup()
+
+    def reload(self):
+        """
+        Ingests new or changed daily reports. Returns True if the data changed.
+        """
+        dataset, generation = self.state
+        data, manifest, dates = refresh_data(
+            self.path_name,
+            dataset.data,
+            self.manifest,
+            no_provinces=self.no_provinces,
+            processes=self.processes,
+        )
+        if data is None:
+            return False
+        dataset = dataset.update(data, dates)
+        dataset.store.get_metrics()
+        self.manifest = manifest
+        with self.cache_lock:
+            self.state = (dataset, generation + 1)
+            self.cache.clear()
+        return True
+
+    def get_cached(self, endpoint, params, compute):
+        dataset, generation = self.state
+        key = (generation, endpoint, tuple(sorted(params.items())))
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        result = compute(dataset)
+        with self.cache_lock:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def query(self, endpoint, params):
+        return self.get_cached(
+            endpoint, params, lambda dataset: answer_query(dataset, endpoint, params)
+        )
+
+    def plot(self, name, params):
+        if name not in PLOT_FUNCTIONS:
+            raise KeyError("Unknown plot {}".format(name))
+
+        def render(dataset):
+            countries = None
+            if "countries" in params:
+                countries = params["countries"].split(",")
+                for c in countries:
+                    if c not in dataset.country_list:
+                        raise KeyError("Unknown country {}".format(c))
+            plot_function = PLOT_FUNCTIONS[name]
+            kwargs = {}
+            if "scale" in params:
+                if "scale" not in inspect.signature(plot_function).parameters:
+                    raise ValueError("The plot {} has no scale".format(name))
+                kwargs["scale"] = params["scale"]
+            with self.plot_lock, plot_directory(self.plot_dir.name):
+                path = dataset.plot(plot_function, countries, **kwargs)
+                with open(path, "rb") as f:
+                    return f.read()
+
+        return self.get_cached("/plot/" + name, params, render)
+
+
+def answer_query(dataset, endpoint, params):
+    """
+    Answers a query of QueryServer. Raises KeyError for unknown endpoints and
+    regions and ValueError for invalid parameters.
+    """
+    if endpoint == "/regions":
+        level = params.get("level")
+        return {"regions": dataset.regions(None if level is None else int(level))}
+    if endpoint == "/icu_limit":
+        country = params.get("country")
+        if country not in dataset.country_list:
+            raise KeyError("Unknown country {}".format(country))
+        duration_of_stay = params.get("duration_of_stay")
+        if duration_of_stay is not None:
+            duration_of_stay = float(duration_of_stay)
+        icu_limit = dataset.icu_limit(
+            country,
+            icu_rate=float(params.get("icu_rate", 0.06)),
+            duration_of_stay=duration_of_stay,
+        )
+        return {"country": country, "ICU Limit": icu_limit}
+    if endpoint == "/top":
+        top = dataset.top(
+            params.get("metric", "Confirmed per Capita"),
+            n=int(params.get("n", 10)),
+            level=int(params.get("level", 0)),
+            ascending=params.get("ascending", "false").lower() == "true",
+        )
+        return frame_to_json(top)
+
+    if endpoint not in ["/series", "/metric", "/growth", "/forecast"]:
+        raise KeyError("Unknown endpoint {}".format(endpoint))
+    region = params.get("region")
+    if region not in dataset.store.region_index:
+        raise KeyError("Unknown region {}".format(region))
+    if endpoint == "/series":
+        column = params.get("column", "Confirmed")
+        if column not in TimeSeriesStore.columns:
+            raise ValueError("Unknown column {}".format(column))
+        return {"region": region, **frame_to_json(dataset.series(region, column))}
+
+    metric = params.get("metric", "Confirmed")
+    if metric not in dataset.store.get_metrics():
+        raise ValueError("Unknown metric {}".format(metric))
+    if endpoint == "/metric":
+        ts = dataset.metric(region, metric)
+    elif endpoint == "/growth":
+        ts = dataset.growth_rate(region, int(params.get("window", 7)), metric)
+    else:
+        ext_base = int(params.get("ext_base", 7))
+        if ext_base < 2:
+            raise ValueError("The forecast needs an ext_base of at least 2 values")
+        ts = dataset.forecast(
+            region, metric, ext_base=ext_base, forecast=int(params.get("forecast", 21))
+        )
+    return {"region": region, **frame_to_json(ts)}
 
-    fname = "{}_detected_fraction.png".format(c)
-    plt.savefig("png/" + fname, bbox_inches="tight")
-    plt.close()
 
-    # reset error handling
-    np.seterr(**old_settings)
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path.startswith("/plot/") and url.path.endswith(".png"):
+                body = self.server.plot(url.path[len("/plot/") : -len(".png")], params)
+                content_type = "image/png"
+            else:
+                body = json.dumps(self.server.query(url.path, params)).encode()
+                content_type = "application/json"
+            status = 200
+        except KeyError as e:
+            status, body = 404, json.dumps({"error": e.args[0]}).encode()
+            content_type = "application/json"
+        except ValueError as e:
+            status, body = 400, json.dumps({"error": str(e)}).encode()
+            content_type = "application/json"
+        except Exception as e:
+            # Answer instead of dropping the connection
+            status, body = 500, json.dumps({"error": repr(e)}).encode()
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(dataset, host="127.0.0.1", port=8000, **kwargs):
+    """
+    Runs a QueryServer until interrupted, see QueryServer for the arguments.
+    """
+    with QueryServer((host, port), dataset, **kwargs) as server:
+        print("Serving on http://{}:{}".format(host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--data", action="store_true", help="Generate data.csv")
+    parser.add_argument(
+        "-d", "--data", action="store_true", help="Generate data.feather"
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Only ingest new or changed daily reports into the existing data",
+    )
+    parser.add_argument(
+        "--csv", action="store_true", help="Additionally export the data to data.csv"
+    )
+    parser.add_argument(
+        "-s",
+        "--source",
+        choices=["daily", "time_series"],
+        default="daily",
+        help="Build the data from the daily reports or from the time series files",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Cross-check the data of both sources and print the differences",
+    )
+    parser.add_argument(
+        "-r",
+        "--regions",
+        action="store_true",
+        help="Keep the province and Admin2 (county) level data",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for parsing reports and rendering plots",
+    )
     parser.add_argument(
         "-p", "--plot", action="store_true", help="Generate all the plots"
     )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Serve queries and plots over HTTP from the data kept in memory",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8000, help="Port of the query server"
+    )
+    parser.add_argument(
+        "--reload",
+        metavar="SECONDS",
+        type=float,
+        help="Let the query server check for new daily reports every SECONDS",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        metavar="SECONDS",
+        type=float,
+        help="Check for new daily reports every SECONDS, ingest them and render "
+        "the plots with --plot",
+    )
+    parser.add_argument(
+        "--debounce",
+        metavar="SECONDS",
+        type=float,
+        default=10,
+        help="Wait until the daily reports did not change for SECONDS before "
+        "ingesting them in watch mode or in the query server",
+    )
+    parser.add_argument(
+        "--seir",
+        metavar="PATH",
+        help="Fit SEIR models to all regions and write their parameters to PATH",
+    )
+    parser.add_argument(
+        "--lags",
+        metavar="PATH",
+        help="Write the delay between confirmed cases and deaths of all regions "
+        "to PATH, with --plot also plot it",
+    )
+    parser.add_argument(
+        "--animate",
+        metavar="FILE",
+        help="Render a time-lapse of the confirmed cases and new infections "
+        "with the forecast of each date to png/FILE (.gif or .mp4)",
+    )
+    parser.add_argument(
+        "--panels",
+        choices=list(PANELS),
+        help="Render this panel for every country, or every region with "
+        "--regions, to png/panels/",
+    )
+    parser.add_argument(
+        "--grid",
+        metavar="ROWSxCOLS",
+        default="1x1",
+        help="Put the panels of ROWS x COLS regions on one page",
+    )
+    parser.add_argument(
+        "--top",
+        metavar="N",
+        type=int,
+        help="Print the N countries ranking highest by every leaderboard metric, "
+        "in watch mode after each update",
+    )
+    parser.add_argument(
+        "--sweep",
+        metavar="PATH",
+        help="Evaluate the estimates over a grid of their assumptions and write "
+        "the table to PATH",
+    )
+    parser.add_argument(
+        "--sweep-grid",
+        metavar="NAME=VALUES",
+        action="append",
+        default=[],
+        help="Comma separated values of one sweep parameter, e.g. "
+        "death_rate=0.01,0.013,0.02",
+    )
 
     args = parser.parse_args()
     # sbn.set_palette("Set1", 8, .75)
     # Load or generate data set
-    if args.data:
-        data = get_data(PATH_DAILY_REPORTS)
-        data.to_csv("data.csv")
+    if args.data and args.source == "time_series":
+        data = get_data_from_time_series(
+            PATH_TIME_SERIES, no_provinces=not args.regions
+        )
+        # The data does not belong to any daily reports
+        manifest = {}
+        save_data(data, PATH_DATA)
+        save_manifest(manifest, PATH_MANIFEST)
+        data = load_data(PATH_DATA)
+    elif args.data:
+        data = None
+        manifest = {}
+        if args.incremental and isfile(PATH_DATA):
+            data = load_data(PATH_DATA)
+            manifest = load_manifest(PATH_MANIFEST)
+        data, manifest = update_data(
+            PATH_DAILY_REPORTS,
+            data,
+            manifest,
+            no_provinces=not args.regions,
+            processes=args.jobs,
+        )
+        save_data(data, PATH_DATA)
+        save_manifest(manifest, PATH_MANIFEST)
+        data = load_data(PATH_DATA)
     else:
         try:
-            data = pd.read_csv("data.csv")
+            data = load_data(PATH_DATA)
         except FileNotFoundError:
-            raise ValueError("Did not find data.csv, run 'kovid.py --data' first")
+            raise ValueError("Did not find data.feather, run 'kovid.py --data' first")
+    if args.csv:
+        save_data(data, PATH_DATA_CSV)
+    if args.check:
+        mismatches = compare_data(
+            get_data(PATH_DAILY_REPORTS, processes=args.jobs),
+            get_data_from_time_series(PATH_TIME_SERIES),
+        )
+        print(
+            "{} differences between daily reports and time series".format(
+                len(mismatches)
+            )
+        )
+        if len(mismatches):
+            print(mismatches.to_string(index=False))
     print("Last data is from {}".format(np.max(data["Date"])))
 
-    if args.plot:
-        extrapolation_base = 6
-        forecast = 14
-        date_lim = pd.to_datetime(
-            [
-                pd.Timestamp("2020-02-15"),
-                pd.Timestamp(np.max(np.array(data.Date)))
-                + pd.Timedelta(forecast, unit="d"),
-            ]
-        )
+    dataset = Dataset(data)
 
-        # https://link.springer.com/article/10.1007/s00134-012-2627-8
-        # https://link.springer.com/article/10.1007/s00134-015-4165-7
-        # https://en.wikipedia.org/wiki/List_of_countries_by_hospital_beds#Numbers
-        country_list = {
-            "Germany": [82.79e6, 29.2 / 100000],
-            "US": [327.2e6, 34.2 / 100000],
-            "Italy": [60.48e6, 12.5 / 100000],
-            "France": [66.99e6, 11.6 / 100000],
-            "Spain": [46.66e6, 9.7 / 100000],
-            "UK": [66.44e6, 6.6 / 100000],
-            "Switzerland": [8.57e6, 11.0 / 100000],
-            "Austria": [8.822e6, 21.8 / 100000],
-            "Sweden": [10.12e6, 5.8/100000],
-            # "Denmark": [5.603e6, 6.7/100000],
-            # "Norway": [5.368e6, 8.0/100000],
-            "South Korea": [51.47e6, 10.6 / 100000],
-            "Japan": [126.8e6, 4.5 / 100000]
-            # "China": [1386e6, 3.6/100000],
-        }
+    if args.sweep:
+        grid = {}
+        for item in args.sweep_grid:
+            name, _, values = item.partition("=")
+            grid[name] = [float(v) for v in values.split(",")]
+        sweep = dataset.sweep(**grid)
+        sweep.to_csv(args.sweep, index=False)
+        print("Wrote {} estimates to {}".format(len(sweep), args.sweep))
 
-        # Derive the COVID ICU capacities assuming a minimum of 3.5 ICUs per 100000
-        # for regular hospital cases and all other ICUs available for corona
-        # patients. This is an arbitrary number that seems somehow reasonable to me
-        # given that some contries can maintain a good-ish health system with only
-        # 4.5 ICUs per 100000 (e.g. Japan, Portugal)
-        for c in country_list.keys():
-            country_list[c][1] -= 3.5 / 100000
+    if args.seir:
+        fits = get_seir_fits(dataset.store, processes=args.jobs)
+        fits.to_csv(args.seir, index=False)
+        print("Wrote {} SEIR fits to {}".format(fits.R0.notna().sum(), args.seir))
 
-        sbn.set_style("whitegrid")
-        sbn.set_palette(
-            sbn.color_palette(palette="colorblind", n_colors=len(country_list), desat=1)
-        )
+    if args.lags:
+        lags = get_lag_table(dataset.store)
+        lags.to_csv(args.lags, index=False)
+        print("Wrote the lags of {} regions to {}".format(len(lags), args.lags))
 
-        # Cases
-        plot_new_infected(
-            data,
-            country_list,
-            avg=5,
-            date_lim=date_lim,
-            forecast=forecast,
-            ext_base=extrapolation_base,
-            scale="log",
-        )
-        plot_confirmed(
-            data,
-            country_list,
-            avg=5,
-            date_lim=date_lim,
-            forecast=forecast,
-            ext_base=extrapolation_base,
-        )
-        plot_estimated_from_deaths(
-            data,
-            country_list,
-            avg=5,
-            date_lim=date_lim,
-            forecast=forecast,
-            ext_base=extrapolation_base,
-        )
-        # plot_estimated_from_delay(data, country_list, avg=5, date_lim=date_lim, forecast=forecast, ext_base=extrapolation_base)
-        # plot_deaths(data, country_list, avg=5, date_lim=date_lim)
-        plot_deathrate(data, country_list, avg=5, date_lim=date_lim)
-        for c in ["Germany", "US", "UK", "Italy", "Switzerland", "South Korea"]:
-            plot_fraction_tested_from_deaths(
-                data, {c: country_list[c]}
-            )
+    if args.top:
+        print_top(dataset, args.top)
 
-        # Rates
-        date_lim = pd.to_datetime(
-            [pd.Timestamp("2020-02-15"), pd.Timestamp(np.max(np.array(data.Date)))]
+    if args.plot:
+        dataset.render(processes=args.jobs)
+        if args.lags:
+            dataset.plot(plot_lag_correlation)
+
+    if args.animate:
+        print("Rendered {}".format(dataset.animate(args.animate)))
+
+    if args.panels:
+        rows, cols = [int(n) for n in args.grid.split("x")]
+        regions = dataset.regions() if args.regions else dataset.regions(level=0)
+        pages = dataset.panels(args.panels, regions, rows, cols, processes=args.jobs)
+        print("Rendered {} panels on {} pages".format(len(regions), len(pages)))
+
+    if args.serve:
+        serve(
+            dataset,
+            port=args.port,
+            manifest=load_manifest(PATH_MANIFEST),
+            reload_interval=args.reload,
+            debounce=args.debounce,
+            no_provinces=not args.regions,
+            processes=args.jobs,
         )
-        country_list_rates = {
-            c: country_list[c] for c in ["Germany", "US", "South Korea", "Italy"]
-        }
-        plot_spread_rate(data, country_list_rates, avg=3, date_lim=date_lim)
 
-        date_lim = pd.to_datetime([pd.Timestamp("2020-03-01"), pd.Timestamp(np.max(np.array(data.Date)))])
-        plot_infection_rate(data, country_list_rates, avg=5, date_lim=date_lim)
+    if args.watch:
+        print("Watching {}".format(PATH_DAILY_REPORTS))
+        try:
+            watch(
+                dataset,
+                load_manifest(PATH_MANIFEST),
+                interval=args.watch,
+                debounce=args.debounce,
+                plot=args.plot,
+                no_provinces=not args.regions,
+                processes=args.jobs,
+                top=args.top,
+            )
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image, PngImagePlugin
+
+import kovid
+
+
+def make_data(confirmed, deaths, country="X", start="2020-01-22"):
+    """
+    Long-format data of one country with a report on every day.
+    """
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range(start, periods=len(confirmed)),
+            "Country/Region": country,
+            "Province/State": np.nan,
+            "Admin2": np.nan,
+            "Confirmed": np.round(confirmed).astype(int),
+            "Deaths": np.round(deaths).astype(int),
+            "Recovered": 0,
+        }
+    )
+
+
+def test_seir_recovers_r0_of_data_starting_mid_epidemic():
+    # The data starts 90 days into the epidemic with deaths on the first day
+    exposed, removed = kovid.integrate_seir(np.array(2.5 / 7.0), np.array(1e-7), 210)
+    data = make_data(3e6 * exposed[90:], 1e5 * removed[90:])
+    assert data.Deaths.iloc[0] >= 5
+
+    fits = kovid.get_seir_fits(kovid.TimeSeriesStore(data))
+    assert abs(fits.R0[0] - 2.5) < 0.1
+    assert fits.rmse[0] < 0.1
+
+
+def test_accessors_work_without_admin2_column():
+    # Data built from reports before 03-22-2020 has no Admin2 column
+    data = make_data(np.arange(10, 20), np.arange(10)).drop(columns="Admin2")
+    province = data.assign(**{"Province/State": "Y", "Confirmed": 1})
+    data = pd.concat([data, province], ignore_index=True)
+
+    ts = kovid.get_confirmed_by_country("X", data)
+    np.testing.assert_array_equal(ts.Confirmed, np.arange(10, 20))
+    ts = kovid.get_confirmed_by_country("X/Y", data)
+    np.testing.assert_array_equal(ts.Confirmed, np.ones(10))
+    assert kovid.TimeSeriesStore(data, level=1).regions == ["X/Y"]
+    assert len(kovid.get_spread_rate_by_country("X", data)) == 9
+
+    # Nor does data of countries only
+    data = data.drop(columns="Province/State")
+    assert kovid.TimeSeriesStore(data).regions == ["X"]
+
+
+def write_report(path, name, rows):
+    header = (
+        "FIPS,Admin2,Province_State,Country_Region,Last_Update,Lat,Long_,"
+        "Confirmed,Deaths,Recovered,Active,Combined_Key\n"
+    )
+    lines = [
+        ",,{},{},2020-04-01 00:00:00,0,0,{},{},0,0,\n".format(p, c, n, d)
+        for c, p, n, d in rows
+    ]
+    (path / name).write_text(header + "".join(lines))
+
+
+def test_incremental_update_rebuilds_data_of_other_options(tmp_path):
+    write_report(tmp_path, "04-01-2020.csv", [("X", "A", 3, 1), ("X", "B", 4, 0)])
+    path_name = str(tmp_path) + "/"
+    data, manifest = kovid.update_data(path_name, None, {}, no_provinces=False)
+    assert set(data.Region) == {"X", "X/A", "X/B"}
+
+    # Same reports, but without provinces now
+    with pytest.warns(UserWarning, match="other options"):
+        data, manifest = kovid.update_data(path_name, data, manifest)
+    assert list(data.Region) == ["X"]
+    assert data.Confirmed.tolist() == [7]
+    assert manifest[kovid.MANIFEST_OPTIONS] == {"no_provinces": True}
+
+    # Manifests without options get them from the data
+    del manifest[kovid.MANIFEST_OPTIONS]
+    write_report(tmp_path, "04-02-2020.csv", [("X", "A", 5, 1)])
+    data, manifest = kovid.update_data(path_name, data, manifest)
+    assert data.Confirmed.tolist() == [7, 5]
+
+
+# Queries of the QueryServer and their expected HTTP status
+SERVER_CHECKS = [
+    ("/regions?level=0", 200),
+    ("/series?region=Germany&column=Deaths", 200),
+    ("/series?region=Germany&metric=Unknown", 200),
+    ("/metric?region=Germany&metric=Unknown", 400),
+    ("/growth?region=Germany", 200),
+    ("/forecast?region=Germany", 200),
+    ("/forecast?region=Germany&ext_base=1", 400),
+    ("/top?metric=Growth%20Rate&n=5", 200),
+    ("/series?region=Nowhere", 404),
+    ("/unknown", 404),
+    ("/plot/confirmed.png?countries=Germany", 200),
+    ("/plot/confirmed.png?countries=Germany,Italy", 200),
+    ("/plot/detected_fraction.png?countries=Germany", 200),
+    ("/plot/detected_fraction.png?countries=Germany&scale=log", 400),
+    ("/plot/lag_correlation.png?scale=log", 400),
+]
+
+
+class QuietQueryHandler(kovid.QueryHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    days = np.arange(60)
+    data = pd.concat(
+        [
+            make_data(100 * np.exp(0.1 * days), 2 * np.exp(0.1 * days), country)
+            for country in ["Germany", "Italy", "Spain"]
+        ],
+        ignore_index=True,
+    )
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("server"))
+    os.mkdir("png")
+    try:
+        with kovid.QueryServer(("127.0.0.1", 0), kovid.Dataset(data)) as server:
+            server.RequestHandlerClass = QuietQueryHandler
+            thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+            thread.start()
+            yield server
+            server.shutdown()
+            thread.join()
+            # Plots of queries must not replace the published ones
+            assert os.listdir("png") == []
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.mark.parametrize("query, status", SERVER_CHECKS)
+def test_query_server_answers(server, query, status):
+    url = "http://127.0.0.1:{}{}".format(server.server_port, query)
+    try:
+        with urlopen(url) as response:
+            answer = response.status
+            body = response.read()
+    except HTTPError as e:
+        answer = e.code
+        body = e.read()
+    assert answer == status
+    if query.startswith("/plot/") and status == 200:
+        assert body.startswith(b"\x89PNG")
+    else:
+        json.loads(body)
+
+
+def test_trends_of_a_single_date_are_nan():
+    store = kovid.TimeSeriesStore(make_data([10], [1]))
+    # New Infections is a difference, so it has no values at all
+    trends = store.get_trends("New Infections", 7, 21)
+    assert np.isnan(trends["slope"]).all()
+    assert np.isnan(trends["forecast"]).all()
+    assert trends["forecast"].shape == (7 + 21 + 1, 1)
+    assert pd.isna(trends["last_date"]).all()
+
+    ts = kovid.Dataset(make_data([10], [1])).forecast("X", "New Infections")
+    assert len(ts) == 0
+
+
+def outbreak_data(countries=("Germany", "Italy")):
+    days = np.arange(60)
+    return pd.concat(
+        [
+            make_data(100 * np.exp(0.1 * days), 2 * np.exp(0.1 * days), country)
+            for country in countries
+        ],
+        ignore_index=True,
+    )
+
+
+def test_truncated_plot_gets_rendered_again(tmp_path):
+    dataset = kovid.Dataset(outbreak_data())
+    with kovid.plot_directory(str(tmp_path) + "/"):
+        path = dataset.plot(kovid.plot_confirmed, ["Germany"])
+        with open(path, "rb") as f:
+            png = f.read()
+        # An interrupted run left half of the file
+        with open(path, "wb") as f:
+            f.write(png[: len(png) // 2])
+        assert dataset.plot(kovid.plot_confirmed, ["Germany"]) == path
+    with open(path, "rb") as f:
+        assert f.read() == png
+
+
+def test_detected_fraction_of_several_countries_raises(tmp_path):
+    store = kovid.TimeSeriesStore(outbreak_data())
+    country_list = {c: kovid.get_country_list()[c] for c in ["Germany", "Italy"]}
+    # A file whose fingerprint matches the invalid call
+    fingerprint = kovid.get_plot_fingerprint(
+        store,
+        country_list,
+        kovid.plot_fraction_tested_from_deaths,
+        date_lim=None,
+        mortality=0.015,
+        offsets=tuple(range(7, 23, 2)),
+    )
+    info = PngImagePlugin.PngInfo()
+    info.add_text(kovid.PLOT_FINGERPRINT_KEY, fingerprint)
+    Image.new("RGB", (1, 1)).save(
+        tmp_path / "Germany_detected_fraction.png", pnginfo=info
+    )
+
+    with kovid.plot_directory(str(tmp_path) + "/"):
+        with pytest.raises(ValueError, match="multiple countries"):
+            kovid.plot_fraction_tested_from_deaths(store, country_list)
+
+
+def test_animation_skips_regions_without_new_infections(tmp_path):
+    # Spain has a single report, so it has no new infections
+    data = pd.concat(
+        [outbreak_data(), make_data([100], [2], "Spain", start="2020-02-01")],
+        ignore_index=True,
+    )
+    dataset = kovid.Dataset(data)
+    with kovid.plot_directory(str(tmp_path) + "/"):
+        path = dataset.animate(
+            countries=["Germany", "Spain"],
+            date_lim=[pd.Timestamp("2020-03-15"), pd.Timestamp("2020-04-15")],
+        )
+    with Image.open(path) as image:
+        assert image.n_frames == 7
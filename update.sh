@@ -12,11 +12,7 @@ else
     git clone https://github.com/CSSEGISandData/COVID-19.git
 fi
 
-# Clean up
-echo "Removing data.csv and png/*..."
-rm data.csv
-rm -f png/*
-
-# Generate new data and plots
-echo "Calling python script to generate new data.csv and plots..."
-python kovid.py --data --plot
+# Generate new data and plots, only new or changed daily reports get ingested
+# and only plots with changed input data get rendered
+echo "Calling python script to update data.feather and generate plots..."
+python kovid.py --data --incremental --plot